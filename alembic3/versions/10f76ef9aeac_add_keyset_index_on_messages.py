@@ -0,0 +1,31 @@
+"""add keyset index on messages
+
+Revision ID: 10f76ef9aeac
+Revises: 928bb5750cd1
+Create Date: 2026-10-18 15:48:12.530274
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '10f76ef9aeac'
+down_revision: Union[str, None] = '928bb5750cd1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # History pages are keyed on id now instead of created_at
+    op.create_index('ix_messages_app_id_contact_id_id', 'messages', ['app_id', 'contact_id', 'id'], unique=False)
+    op.drop_index('ix_messages_app_id_contact_id_created_at', table_name='messages')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index('ix_messages_app_id_contact_id_created_at', 'messages', ['app_id', 'contact_id', 'created_at'], unique=False)
+    op.drop_index('ix_messages_app_id_contact_id_id', table_name='messages')
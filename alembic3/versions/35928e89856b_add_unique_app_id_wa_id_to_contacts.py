@@ -0,0 +1,72 @@
+"""add unique (app_id, wa_id) to contacts
+
+Revision ID: 35928e89856b
+Revises: 15c2fdc49952
+Create Date: 2026-10-18 11:41:07.918344
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '35928e89856b'
+down_revision: Union[str, None] = '15c2fdc49952'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Concurrent webhooks may already have created duplicate senders: keep the
+    # oldest contact of each (app_id, wa_id) and move messages and tags onto it
+    op.execute(
+        """
+        CREATE TEMPORARY TABLE contact_duplicates AS
+        SELECT c.id AS duplicate_id, k.keep_id
+        FROM contacts c
+        JOIN (
+            SELECT app_id, wa_id, MIN(id) AS keep_id
+            FROM contacts
+            GROUP BY app_id, wa_id
+            HAVING COUNT(*) > 1
+        ) k ON c.app_id = k.app_id AND c.wa_id = k.wa_id AND c.id <> k.keep_id
+        """
+    )
+    op.execute(
+        """
+        UPDATE messages m
+        JOIN contact_duplicates d ON m.contact_id = d.duplicate_id
+        SET m.contact_id = d.keep_id
+        """
+    )
+    op.execute(
+        """
+        INSERT IGNORE INTO contact_tags (contact_id, tag_id)
+        SELECT d.keep_id, ct.tag_id
+        FROM contact_tags ct
+        JOIN contact_duplicates d ON ct.contact_id = d.duplicate_id
+        """
+    )
+    op.execute(
+        """
+        DELETE ct FROM contact_tags ct
+        JOIN contact_duplicates d ON ct.contact_id = d.duplicate_id
+        """
+    )
+    op.execute(
+        """
+        DELETE c FROM contacts c
+        JOIN contact_duplicates d ON c.id = d.duplicate_id
+        """
+    )
+    op.execute("DROP TEMPORARY TABLE contact_duplicates")
+
+    op.create_unique_constraint('uq_contacts_app_id_wa_id', 'contacts', ['app_id', 'wa_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_contacts_app_id_wa_id', 'contacts', type_='unique')
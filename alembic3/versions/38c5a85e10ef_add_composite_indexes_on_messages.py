@@ -0,0 +1,37 @@
+"""add composite indexes on messages
+
+Revision ID: 38c5a85e10ef
+Revises: 35928e89856b
+Create Date: 2026-10-18 14:22:31.604118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '38c5a85e10ef'
+down_revision: Union[str, None] = '35928e89856b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Conversation list: MAX(sent_at) per contact of an app, then the join back
+    op.create_index('ix_messages_app_id_contact_id_sent_at', 'messages', ['app_id', 'contact_id', 'sent_at'], unique=False)
+    # History page of one conversation, ordered by created_at
+    op.create_index('ix_messages_app_id_contact_id_created_at', 'messages', ['app_id', 'contact_id', 'created_at'], unique=False)
+    # from_number OR to_number lookup (index merge union)
+    op.create_index('ix_messages_app_id_from_number', 'messages', ['app_id', 'from_number'], unique=False)
+    op.create_index('ix_messages_app_id_to_number', 'messages', ['app_id', 'to_number'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_app_id_to_number', table_name='messages')
+    op.drop_index('ix_messages_app_id_from_number', table_name='messages')
+    op.drop_index('ix_messages_app_id_contact_id_created_at', table_name='messages')
+    op.drop_index('ix_messages_app_id_contact_id_sent_at', table_name='messages')
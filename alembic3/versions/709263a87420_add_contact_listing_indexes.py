@@ -0,0 +1,39 @@
+"""add contact listing indexes
+
+Revision ID: 709263a87420
+Revises: 10f76ef9aeac
+Create Date: 2026-10-18 16:20:05.918442
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '709263a87420'
+down_revision: Union[str, None] = '10f76ef9aeac'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Filters of GET /contacts; number prefixes use uq_contacts_app_id_wa_id
+    op.create_index('ix_contacts_app_id_opted_in', 'contacts', ['app_id', 'opted_in'], unique=False)
+    op.create_index('ix_contacts_app_id_is_active', 'contacts', ['app_id', 'is_active'], unique=False)
+    op.create_index('ix_contacts_app_id_source', 'contacts', ['app_id', 'source'], unique=False)
+    op.create_index('ix_contacts_app_id_last_active_at', 'contacts', ['app_id', 'last_active_at'], unique=False)
+    op.create_index('ix_contacts_app_id_name', 'contacts', ['app_id', 'name'], unique=False)
+    op.create_index('ix_contact_tags_tag_id_contact_id', 'contact_tags', ['tag_id', 'contact_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_contact_tags_tag_id_contact_id', table_name='contact_tags')
+    op.drop_index('ix_contacts_app_id_name', table_name='contacts')
+    op.drop_index('ix_contacts_app_id_last_active_at', table_name='contacts')
+    op.drop_index('ix_contacts_app_id_source', table_name='contacts')
+    op.drop_index('ix_contacts_app_id_is_active', table_name='contacts')
+    op.drop_index('ix_contacts_app_id_opted_in', table_name='contacts')
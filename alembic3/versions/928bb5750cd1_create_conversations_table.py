@@ -0,0 +1,91 @@
+"""create conversations table
+
+Revision ID: 928bb5750cd1
+Revises: 38c5a85e10ef
+Create Date: 2026-10-18 15:07:44.281093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '928bb5750cd1'
+down_revision: Union[str, None] = '38c5a85e10ef'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('conversations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('app_id', sa.Integer(), nullable=False),
+    sa.Column('contact_id', sa.Integer(), nullable=False),
+    sa.Column('last_message_id', sa.Integer(), nullable=True),
+    sa.Column('last_message_type', sa.String(length=20), nullable=True),
+    sa.Column('last_message_preview', sa.String(length=255), nullable=True),
+    sa.Column('last_message_status', sa.String(length=20), nullable=True),
+    sa.Column('last_sent_at', sa.DateTime(), nullable=True),
+    sa.Column('unread_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['app_id'], ['apps.id'], ),
+    sa.ForeignKeyConstraint(['contact_id'], ['contacts.id'], ),
+    sa.ForeignKeyConstraint(['last_message_id'], ['messages.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('app_id', 'contact_id', name='uq_conversations_app_id_contact_id')
+    )
+    op.create_index(op.f('ix_conversations_id'), 'conversations', ['id'], unique=False)
+    op.create_index('ix_conversations_app_id_last_sent_at', 'conversations', ['app_id', 'last_sent_at'], unique=False)
+
+    # Backfill one summary per (app, contact) from the latest message (by
+    # sent_at, then id) and the count of inbound messages not yet read
+    op.execute(
+        """
+        INSERT INTO conversations (
+            app_id, contact_id, last_message_id, last_message_type,
+            last_message_preview, last_message_status, last_sent_at,
+            unread_count, updated_at
+        )
+        SELECT
+            k.app_id,
+            k.contact_id,
+            m.id,
+            m.message_type,
+            LEFT(
+                COALESCE(
+                    JSON_UNQUOTE(JSON_EXTRACT(m.payload, '$.body')),
+                    JSON_UNQUOTE(JSON_EXTRACT(m.payload, '$.caption'))
+                ),
+                255
+            ),
+            m.status,
+            m.sent_at,
+            k.unread_count,
+            UTC_TIMESTAMP()
+        FROM (
+            SELECT
+                app_id,
+                contact_id,
+                SUM(direction = 'inbound' AND status <> 'read') AS unread_count
+            FROM messages
+            GROUP BY app_id, contact_id
+        ) k
+        JOIN messages m ON m.id = (
+            SELECT m2.id
+            FROM messages m2
+            WHERE m2.app_id = k.app_id AND m2.contact_id = k.contact_id
+            ORDER BY m2.sent_at DESC, m2.id DESC
+            LIMIT 1
+        )
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_conversations_app_id_last_sent_at', table_name='conversations')
+    op.drop_index(op.f('ix_conversations_id'), table_name='conversations')
+    op.drop_table('conversations')
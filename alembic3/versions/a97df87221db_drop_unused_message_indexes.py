@@ -0,0 +1,34 @@
+"""drop unused message indexes
+
+Revision ID: a97df87221db
+Revises: 709263a87420
+Create Date: 2026-10-18 17:41:12.305817
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a97df87221db'
+down_revision: Union[str, None] = '709263a87420'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # The inbox reads the conversations table and history pages on
+    # (app_id, contact_id, id): nothing reads these any more
+    op.drop_index('ix_messages_app_id_contact_id_sent_at', table_name='messages')
+    op.drop_index('ix_messages_app_id_from_number', table_name='messages')
+    op.drop_index('ix_messages_app_id_to_number', table_name='messages')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index('ix_messages_app_id_to_number', 'messages', ['app_id', 'to_number'], unique=False)
+    op.create_index('ix_messages_app_id_from_number', 'messages', ['app_id', 'from_number'], unique=False)
+    op.create_index('ix_messages_app_id_contact_id_sent_at', 'messages', ['app_id', 'contact_id', 'sent_at'], unique=False)
@@ -1,10 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Response
 from sqlalchemy.orm import Session
 
-from database import get_db
+from database import get_db, get_read_db
 from models import App
 from schemas import AppCreate, AppRead
 from dependency import get_current_user
+from app.services.app_registry import app_registry
 
 router = APIRouter(tags=["Apps"])
 
@@ -13,7 +14,7 @@ router = APIRouter(tags=["Apps"])
 def get_apps(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     user=Depends(get_current_user),
 ):
     return db.query(App).filter(App.user_id == user.id).offset(skip).limit(limit).all()
@@ -34,11 +35,14 @@ def create_app(
     db.add(db_app)
     db.commit()
     db.refresh(db_app)
+    app_registry.invalidate()
     return db_app
 
 
 @router.get("/apps/{app_id}", response_model=AppRead)
-def get_app(app_id: int, db: Session = Depends(get_db), user=Depends(get_current_user)):
+def get_app(
+    app_id: int, db: Session = Depends(get_read_db), user=Depends(get_current_user)
+):
     app = db.query(App).filter(App.id == app_id, App.user_id == user.id).first()
     if not app:
         raise HTTPException(status_code=404, detail="App not found")
@@ -60,6 +64,7 @@ def update_app(
     db_app.status = app_update.status
     db.commit()
     db.refresh(db_app)
+    app_registry.invalidate()
     return db_app
 
 
@@ -73,5 +78,6 @@ def delete_app(
 
     db.delete(app)
     db.commit()
+    app_registry.invalidate()
     # Return 204 No Content (no body)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
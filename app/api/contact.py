@@ -1,20 +1,91 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.responses import Response
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import and_, func, select
 from typing import List, Optional
 from datetime import datetime
 
-from database import get_db
+from database import get_db, get_read_db
 from models import Contact, Tag
 from schemas import ContactCreate, ContactUpdate, ContactRead
+from dependency import get_current_user
+from app.services.activity_buffer import activity_buffer
+from app.services.app_registry import app_registry
+from app.services.count_cache import contact_count_cache
+from app.crud.contacts import contacts_query, get_contact
+from app.crud.pagination import encode_cursor, decode_cursor
+
+# Largest page of contacts a client may ask for
+CONTACTS_MAX_LIMIT = 500
 
 router = APIRouter(tags=["Contacts"])
 
 
 @router.get("/contacts", response_model=List[ContactRead])
-def read_contacts(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(Contact).offset(skip).limit(limit).all()
+def read_contacts(
+    response: Response,
+    app_id: int = Query(description="Filter by App ID"),
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    tag_id: Optional[int] = None,
+    opted_in: Optional[bool] = None,
+    is_active: Optional[bool] = None,
+    source: Optional[str] = None,
+    last_active_from: Optional[datetime] = None,
+    last_active_to: Optional[datetime] = None,
+    name_prefix: Optional[str] = None,
+    number_prefix: Optional[str] = None,
+    include_total: bool = False,
+    skip: Optional[int] = Query(
+        None, deprecated=True, description="Offset; use the X-Next-Cursor cursor"
+    ),
+    db: Session = Depends(get_read_db),
+    user=Depends(get_current_user),
+):
+    # Only the owner of the app may list its contacts
+    app = app_registry.get_by_id(app_id)
+    if not app or app.user_id != user.id:
+        raise HTTPException(status_code=404, detail="App not found")
+
+    filters = {
+        "tag_id": tag_id,
+        "opted_in": opted_in,
+        "is_active": is_active,
+        "source": source,
+        "last_active_from": last_active_from,
+        "last_active_to": last_active_to,
+        "name_prefix": name_prefix,
+        "number_prefix": number_prefix,
+    }
+    query = contacts_query(app_id, **filters)
+
+    if include_total:
+        # Approximate: a count of the same filters taken at most a TTL ago
+        key = (app_id, tuple(sorted(filters.items())))
+        count = select(func.count()).select_from(query.order_by(None).subquery())
+        total = contact_count_cache.get_or_count(key, lambda: db.scalar(count))
+        response.headers["X-Total-Count"] = str(total)
+
+    # Keyset pagination on id: the cursor is the last id of the previous page
+    if cursor:
+        try:
+            before_id = int(decode_cursor(cursor)["before_id"])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(Contact.id < before_id)
+    elif skip:
+        # Deprecated offset paging of older clients; X-Next-Cursor still
+        # comes back so they can switch to the cursor
+        query = query.offset(skip)
+
+    limit = min(max(limit, 1), CONTACTS_MAX_LIMIT)
+    contacts = list(db.scalars(query.limit(limit + 1)))
+    if len(contacts) > limit:
+        contacts = contacts[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(
+            {"before_id": contacts[-1].id}
+        )
+    return activity_buffer.apply(contacts)
 
 
 @router.post("/contacts", response_model=ContactRead)
@@ -37,34 +108,35 @@ def create_contact(contact: ContactCreate, db: Session = Depends(get_db)):
             detail="A contact with this app_id and wa_id already exists.",
         )
 
-    # Create contact
-    db_contact = Contact(**contact_data)
-    db.add(db_contact)
-    db.commit()
-    db.refresh(db_contact)
-
-    # Handle tag_ids (if provided)
+    # Resolve tag_ids (if provided) so the contact and its tags go in one commit
+    db_tags = []
     if contact.tag_ids:
         try:
             tag_ids = [int(tid) for tid in contact.tag_ids]
-            db_tags = db.query(Tag).filter(Tag.id.in_(tag_ids)).all()
-            db_contact.tags.extend(db_tags)
-            db.commit()
-            db.refresh(db_contact)
         except ValueError:
             raise HTTPException(
                 status_code=400,
                 detail="Invalid tag_ids format. Must be list of integers or strings of integers.",
             )
+        db_tags = db.query(Tag).filter(Tag.id.in_(tag_ids)).all()
 
-    return db_contact
+    # Create contact
+    db_contact = Contact(**contact_data, tags=db_tags)
+    db.add(db_contact)
+    db.flush()
+    contact_id = db_contact.id
+    db.commit()
+
+    # Reload with its tags eagerly, instead of a lazy load during serialization
+    return get_contact(db, contact_id)
 
 
 @router.get("/contacts/{contact_id}", response_model=ContactRead)
-def read_contact(contact_id: int, db: Session = Depends(get_db)):
-    contact = db.query(Contact).filter(Contact.id == contact_id).first()
+def read_contact(contact_id: int, db: Session = Depends(get_read_db)):
+    contact = get_contact(db, contact_id)
     if not contact:
         raise HTTPException(status_code=404, detail="Contact not found")
+    activity_buffer.apply([contact])
     return contact
 
 
@@ -72,7 +144,8 @@ def read_contact(contact_id: int, db: Session = Depends(get_db)):
 def update_contact(
     contact_id: int, contact: ContactUpdate, db: Session = Depends(get_db)
 ):
-    db_contact = db.query(Contact).filter(Contact.id == contact_id).first()
+    # Tags loaded up front: replacing the collection needs its current contents
+    db_contact = get_contact(db, contact_id)
     if not db_contact:
         raise HTTPException(status_code=404, detail="Contact not found")
 
@@ -118,8 +191,7 @@ def update_contact(
             )
 
     db.commit()
-    db.refresh(db_contact)
-    return db_contact
+    return get_contact(db, contact_id)
 
 
 @router.get("/contacts/{contact_id}/opted-in")
@@ -1,16 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException, Form, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Form, UploadFile, File, Response
 from sqlalchemy.orm import Session
-from database import get_db
-from models import App, Contact, Message
-from sqlalchemy import func, desc, and_
+from database import get_db, get_read_db
+from models import Contact, Message
 from datetime import datetime
+from typing import Optional
 import os
-from utils import human_readable_time_diff
 from schemas import MessageCreate
 from fastapi.responses import JSONResponse
 import uuid
 import shutil
 from config import config
+from app.services.app_registry import app_registry
+from app.crud.conversations import (
+    inbox_query,
+    status_change_stmt,
+    summary_rows,
+    upsert_summaries_stmt,
+)
+from app.crud.message import (
+    serialize_conversation,
+    history_limit,
+    history_page,
+    history_position,
+    history_query,
+)
 
 router = APIRouter(tags=["Messages"])
 UPLOAD_DIR = "./uploads"
@@ -44,74 +57,55 @@ async def upload_file(file: UploadFile = File(...)):
 
 
 @router.get("/conversations")
-def get_recent_conversations(app_id: int, db: Session = Depends(get_db)):
-    app = db.query(App).filter(App.id == app_id).first()
+def get_recent_conversations(app_id: int, db: Session = Depends(get_read_db)):
+    app = app_registry.get_by_id(app_id)
     if not app:
         raise HTTPException(status_code=404, detail="App not found")
 
-    subq = (
-        db.query(Message.contact_id, func.max(Message.sent_at).label("last_sent_at"))
-        .filter(Message.app_id == app_id)
-        .group_by(Message.contact_id)
-        .subquery()
-    )
-
-    last_messages = (
-        db.query(
-            Message,
-            Contact.name.label("contact_name"),
-            Contact.wa_id.label("wa_id"),
-        )
-        .join(
-            subq,
-            and_(
-                Message.contact_id == subq.c.contact_id,
-                Message.sent_at == subq.c.last_sent_at,
-            ),
-        )
-        .join(Contact, Contact.id == Message.contact_id)
-        .order_by(desc(Message.sent_at))
-        .all()
-    )
-
-    # Prepare response
-    conversations = []
-    for msg, contact_name, wa_id in last_messages:
-        display_name = contact_name or wa_id
-        time_display = human_readable_time_diff(msg.sent_at)
-
-        conversations.append(
-            {
-                "wa_id": wa_id,
-                "contact_name": display_name,
-                "last_message_type": msg.message_type,
-                "last_message_time": time_display,
-            }
-        )
-
-    return conversations
+    return [serialize_conversation(*row) for row in db.execute(inbox_query(app_id))]
 
 
 @router.get("/messages/{contact_number}")
 def get_messages_by_contact(
-    app_id: int, contact_number: str, db: Session = Depends(get_db)
+    app_id: int,
+    contact_number: str,
+    response: Response,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    db: Session = Depends(get_read_db),
 ):
-    app = db.query(App).filter(App.id == app_id).first()
+    app = app_registry.get_by_id(app_id)
     if not app:
         raise HTTPException(status_code=404, detail="App not found")
 
-    return (
-        db.query(Message)
-        .filter(
-            Message.app_id == app_id,
-            (
-                (Message.from_number == contact_number)
-                | (Message.to_number == contact_number)
-            ),
-        )
-        .order_by(Message.created_at.desc())
-        .all()
+    try:
+        before_id, after_id = history_position(cursor, before_id, after_id)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    limit = history_limit(limit)
+
+    contact = (
+        db.query(Contact)
+        .filter(Contact.app_id == app_id, Contact.wa_id == contact_number)
+        .first()
     )
+    if not contact:
+        return []
+
+    rows = db.scalars(history_query(app_id, contact.id, limit, before_id, after_id))
+    messages, prev_cursor, next_cursor = history_page(
+        list(rows), limit, before_id, after_id
+    )
+
+    # The body stays a newest-first list; cursors for the older and newer
+    # pages travel in headers
+    if prev_cursor:
+        response.headers["X-Prev-Cursor"] = prev_cursor
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return messages[::-1]
 
 
 @router.post("/messages")
@@ -120,12 +114,16 @@ async def create_message(
     db: Session = Depends(get_db),
 ):
     # Validate app
-    db_app = db.query(App).filter(App.id == message_in.app_id).first()
+    db_app = await app_registry.aget_by_id(message_in.app_id)
     if not db_app:
         raise HTTPException(status_code=404, detail="App not found")
 
     # Validate contact
-    db_contact = db.query(Contact).filter(Contact.wa_id == message_in.to_number).first()
+    db_contact = (
+        db.query(Contact)
+        .filter(Contact.app_id == db_app.id, Contact.wa_id == message_in.to_number)
+        .first()
+    )
     if not db_contact:
         raise HTTPException(status_code=404, detail="Contact not found")
 
@@ -154,6 +152,8 @@ async def create_message(
     )
 
     db.add(db_msg)
+    db.flush()
+    db.execute(upsert_summaries_stmt(), summary_rows([db_msg]))
     db.commit()
     db.refresh(db_msg)
 
@@ -168,6 +168,7 @@ def mark_message_delivered(msg_id: int, db: Session = Depends(get_db)):
 
     msg.status = "delivered"
     msg.received_at = datetime.utcnow()
+    db.execute(status_change_stmt(msg, was_unread=False))
     db.commit()
     return {"status": "delivered", "message_id": msg_id}
 
@@ -178,7 +179,9 @@ def mark_message_read(msg_id: int, db: Session = Depends(get_db)):
     if not msg:
         raise HTTPException(status_code=404, detail="Message not found")
 
+    was_unread = msg.direction == "inbound" and msg.status != "read"
     msg.status = "read"
     msg.read_at = datetime.utcnow()
+    db.execute(status_change_stmt(msg, was_unread))
     db.commit()
     return {"status": "read", "message_id": msg_id}
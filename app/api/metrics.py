@@ -0,0 +1,30 @@
+from fastapi import APIRouter
+
+from database import pool_status
+from app.services.webhook_queue import webhook_queue
+from app.services.dedupe import recent_message_ids
+from app.services.status_buffer import status_buffer
+from app.services.phone import country_info_cache
+from app.services.app_registry import app_registry
+from app.services.activity_buffer import activity_buffer
+from app.services.count_cache import contact_count_cache
+from connection_pool import hub
+from app.services.broadcast import broadcaster
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics")
+def get_metrics():
+    return {
+        "database_pool": pool_status(),
+        "webhook_queue": webhook_queue.stats(),
+        "webhook_dedupe": recent_message_ids.stats(),
+        "status_buffer": status_buffer.stats(),
+        "phone_cache": country_info_cache.stats(),
+        "app_registry": app_registry.stats(),
+        "activity_buffer": activity_buffer.stats(),
+        "contact_count_cache": contact_count_cache.stats(),
+        "websocket_hub": hub.stats(),
+        "broadcast": broadcaster.stats(),
+    }
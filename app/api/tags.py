@@ -2,7 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
 from fastapi.responses import Response
 
-from database import get_db
+from database import get_db, get_read_db
 from models import Tag
 from schemas import TagCreate, TagRead, TagUpdate
 
@@ -14,7 +14,7 @@ def get_tags(
     skip: int = 0,
     limit: int = 100,
     app_id: int = Query(description="Filter by App ID"),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     return db.query(Tag).filter(Tag.app_id == app_id).offset(skip).limit(limit).all()
 
@@ -37,7 +37,7 @@ def create_tag(tag: TagCreate, db: Session = Depends(get_db)):
 
 
 @router.get("/tags/{tag_id}", response_model=TagRead)
-def get_tag(tag_id: int, db: Session = Depends(get_db)):
+def get_tag(tag_id: int, db: Session = Depends(get_read_db)):
     tag = db.query(Tag).filter(Tag.id == tag_id).first()
     if not tag:
         raise HTTPException(status_code=404, detail="Tag not found")
@@ -1,141 +1,297 @@
 from fastapi import APIRouter, Request, HTTPException, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
-from database import get_db
-from models import App, Contact, Message
-import phonenumbers
-from phonenumbers import geocoder
+from database import get_async_db, AsyncSessionLocal
+from config import config
+from models import Message
 import json
 
-from app.crud.message import (
-    get_recent_conversations_ws,
-    get_contact_by_by_id_ws,
-    get_messages_by_contact_ws,
-    handle_send_message
-)
+from app.crud.message import message_created_event, conversation_updated_event
 
 from app.websocket import broadcast_to_app
+from connection_pool import CONVERSATIONS_TOPIC, contact_topic
+from app.services.webhook_queue import webhook_queue
+from app.services.dedupe import recent_message_ids
+from app.services.status_buffer import status_buffer
+from app.services.phone import extract_country_info
+from app.services.app_registry import app_registry
+from app.crud.contacts import upsert_contacts
+from app.crud.conversations import (
+    summaries_query,
+    summary_rows,
+    upsert_summaries_stmt,
+)
+from app.services.activity_buffer import activity_buffer
 
 router = APIRouter(tags=["Webhook"])
 
+# MySQL error code of a unique index violation (ER_DUP_ENTRY)
+DUPLICATE_KEY = 1062
 
-def extract_country_info(wa_id: str):
-    try:
-        parsed = phonenumbers.parse("+" + wa_id)
-        country_code = str(parsed.country_code)
-        country_iso = phonenumbers.region_code_for_number(parsed)
-        country_name = geocoder.description_for_number(parsed, "en")
-        local_number = (
-            wa_id[len(country_code) :] if wa_id.startswith(country_code) else wa_id
+
+def iter_webhook_changes(data: dict):
+    # A single delivery can batch several entries, each with several changes
+    for entry in data.get("entry", []):
+        for change in entry.get("changes", []):
+            yield change.get("value", {})
+
+
+async def drop_duplicate_messages(db: AsyncSession, inbound: list):
+    # Provider retries re-send the same message id: reject them from the
+    # in-process cache first and fall back to a single indexed lookup
+    fresh, pending_ids = [], set()
+    for item in inbound:
+        message_id = item[3].get("id")
+        if message_id:
+            if message_id in pending_ids or message_id in recent_message_ids:
+                continue
+            pending_ids.add(message_id)
+        fresh.append(item)
+
+    if pending_ids:
+        stored = set(
+            await db.scalars(
+                select(Message.message_id).where(Message.message_id.in_(pending_ids))
+            )
         )
-        return {
-            "country_code": country_code,
-            "country_iso": country_iso,
-            "country_name": country_name,
-            "local_number": local_number,
-        }
-    except Exception:
-        return {
-            "country_code": "",
-            "country_iso": "",
-            "country_name": "",
-            "local_number": wa_id,
+        if stored:
+            recent_message_ids.add_many(stored)
+            fresh = [item for item in fresh if item[3].get("id") not in stored]
+
+    return fresh
+
+
+async def ingest_webhook_payload(db: AsyncSession, data: dict):
+    """
+    Store every inbound message of a webhook delivery in one transaction.
+
+    Apps come from the app registry, contacts are upserted in bulk and all
+    messages are written with a single multi-row insert, so the number of
+    round trips does not grow with the size of the delivery. Messages already
+    stored (provider retries) are skipped, so redelivering a payload is a
+    no-op. Status callbacks are handed to the status buffer. Returns
+    (message, contact_name) pairs for the newly stored messages, and the
+    updated summary rows of their conversations.
+    """
+    now = datetime.utcnow()
+
+    # Walk the whole payload: every entry, change and message
+    inbound = []
+    statuses = 0
+    for change in iter_webhook_changes(data):
+        receiver_number = change.get("metadata", {}).get("display_phone_number")
+        contacts_data = change.get("contacts", [])
+        profiles = {
+            c.get("wa_id"): c.get("profile", {}).get("name", "Unknown")
+            for c in contacts_data
         }
 
+        for message_data in change.get("messages", []):
+            sender_wa_id = message_data.get("from")
+            if not sender_wa_id and len(contacts_data) == 1:
+                sender_wa_id = contacts_data[0].get("wa_id")
+            if not sender_wa_id:
+                raise HTTPException(status_code=400, detail="Missing sender wa_id")
+            if not receiver_number:
+                raise HTTPException(status_code=400, detail="Missing receiver number")
+            sender_name = profiles.get(sender_wa_id, "Unknown")
+            inbound.append((receiver_number, sender_wa_id, sender_name, message_data))
 
-def get_or_create_contact(
-    db: Session,
-    app_id: int,
-    wa_id: str,
-    local_number: str,
-    name: str,
-    country_info: dict,
-):
-    contact = db.query(Contact).filter_by(app_id=app_id, wa_id=wa_id).first()
-    if not contact:
-        contact = Contact(
-            app_id=app_id,
-            wa_id=wa_id,
-            mobile_number=local_number,
-            country_code=country_info["country_code"],
-            name=name,
-            last_active_at=datetime.utcnow(),
-        )
-        db.add(contact)
-        db.commit()
-        db.refresh(contact)
-    else:
-        contact.last_active_at = datetime.utcnow()
-        db.commit()
-    return contact
+        # Delivery/read callbacks are coalesced and applied in batches
+        for status_data in change.get("statuses", []):
+            # Outbound messages store the id returned by the send API (gs_id)
+            message_id = status_data.get("gs_id") or status_data.get("id")
+            if not message_id:
+                continue
+            timestamp = datetime.fromtimestamp(
+                int(status_data.get("timestamp", now.timestamp()))
+            )
+            status_buffer.add(message_id, status_data.get("status"), timestamp)
+            statuses += 1
 
+    if not inbound:
+        if statuses:
+            return [], []
+        raise HTTPException(status_code=400, detail="No message found")
 
-@router.post("/webhook")
-async def webhook(request: Request, db: Session = Depends(get_db)):
-    try:
-        data = await request.json()
-        entry = data.get("entry", [])[0]
-        change = entry.get("changes", [])[0].get("value", {})
-
-        # Extract sender info
-        contact_data = change.get("contacts", [])[0]
-        sender_wa_id = contact_data.get("wa_id")
-        if not sender_wa_id:
-            raise HTTPException(status_code=400, detail="Missing sender wa_id")
-        country_info = extract_country_info(sender_wa_id)
-        sender_name = contact_data.get("profile", {}).get("name", "Unknown")
-        local_number = country_info["local_number"]
-
-        # Extract message info
-        messages = change.get("messages", [])
-        if not messages:
-            raise HTTPException(status_code=400, detail="No message found")
-        message_data = messages[0]
+    inbound = await drop_duplicate_messages(db, inbound)
+    if not inbound:
+        return [], []
+
+    # Resolve every receiving app from the in-memory registry
+    apps = {}
+    for receiver, _, _, _ in inbound:
+        if receiver not in apps:
+            apps[receiver] = await app_registry.aget_by_number(receiver)
+    apps = {number: app for number, app in apps.items() if app}
+    inbound = [item for item in inbound if item[0] in apps]
+    if not inbound:
+        raise HTTPException(status_code=404, detail="App not found for receiver")
+
+    # Upsert every sender in one statement and read their ids back in one query
+    senders = {}
+    for receiver, wa_id, name, _ in inbound:
+        key = (apps[receiver].id, wa_id)
+        if key in senders:
+            continue
+        country_info = extract_country_info(wa_id)
+        senders[key] = {
+            "app_id": key[0],
+            "wa_id": wa_id,
+            "mobile_number": country_info["local_number"],
+            "country_code": country_info["country_code"],
+            "name": name,
+            "last_active_at": now,
+        }
+    contacts = await upsert_contacts(db, list(senders.values()))
+
+    # Single multi-row insert for all messages of the delivery
+    rows = []
+    for receiver, wa_id, _, message_data in inbound:
+        app_id = apps[receiver].id
         message_type = message_data.get("type", "text")
         timestamp = datetime.fromtimestamp(
-            int(message_data.get("timestamp", datetime.utcnow().timestamp()))
+            int(message_data.get("timestamp", now.timestamp()))
+        )
+        rows.append(
+            {
+                "app_id": app_id,
+                "contact_id": contacts[(app_id, wa_id)].id,
+                "message_id": message_data.get("id"),
+                "from_number": wa_id,
+                "to_number": receiver,
+                "message_type": message_type,
+                "payload": message_data.get(message_type, []),
+                "direction": "inbound",
+                "status": "sent",
+                "sent_at": timestamp,
+                "created_at": now,
+            }
         )
+    messages = await insert_messages(db, rows)
 
-        # Extract receiver info (business account)
-        receiver_number = change.get("metadata", {}).get("display_phone_number")
-        if not receiver_number:
-            raise HTTPException(status_code=400, detail="Missing receiver number")
-        db_app = db.query(App).filter(App.whatsapp_number == receiver_number).first()
-        if not db_app:
-            raise HTTPException(status_code=404, detail="App not found for receiver")
-
-        # Get or create sender and receiver contacts
-        sender = get_or_create_contact(
-            db, db_app.id, sender_wa_id, local_number, sender_name, country_info
+    # Conversation summaries move in the same transaction as the messages, and
+    # are read back for the conversation.updated events
+    conversations = []
+    if messages:
+        await db.execute(upsert_summaries_stmt(), summary_rows(messages))
+        keys = list({(m.app_id, m.contact_id) for m in messages})
+        conversations = (await db.execute(summaries_query(keys))).all()
+    await db.commit()
+    recent_message_ids.add_many(
+        [row["message_id"] for row in rows if row["message_id"]]
+    )
+    for contact in contacts.values():
+        activity_buffer.touch(contact.id, now)
+
+    ingested = [
+        (message, contacts[(message.app_id, message.from_number)].name)
+        for message in messages
+    ]
+    return ingested, conversations
+
+
+def is_duplicate_key(error: IntegrityError) -> bool:
+    return bool(error.orig.args) and error.orig.args[0] == DUPLICATE_KEY
+
+
+async def insert_messages(db: AsyncSession, rows: list) -> list:
+    """
+    Insert message rows and return Message objects for those stored by this call.
+
+    Rows with a provider id go out as one multi-row INSERT in a savepoint. If
+    a concurrent delivery of the same retry stored one of them first, the
+    unique message_id index rejects the batch and the rows are inserted one
+    by one instead, skipping the ones that lost the race (they are neither
+    counted in the summaries nor broadcast again). Their ids are read back
+    through the message_id index. Rows without a provider id can't race and
+    are inserted singly, taking their id from the insert.
+    """
+    keyed = [row for row in rows if row["message_id"]]
+    stored = keyed
+    if keyed:
+        try:
+            async with db.begin_nested():
+                await db.execute(insert(Message), keyed)
+        except IntegrityError as e:
+            if not is_duplicate_key(e):
+                raise
+            stored = []
+            for row in keyed:
+                try:
+                    async with db.begin_nested():
+                        await db.execute(insert(Message).values(row))
+                    stored.append(row)
+                except IntegrityError as e:
+                    if not is_duplicate_key(e):
+                        raise
+
+    ids = {}
+    if stored:
+        ids = dict(
+            (
+                await db.execute(
+                    select(Message.message_id, Message.id).where(
+                        Message.message_id.in_([row["message_id"] for row in stored])
+                    )
+                )
+            ).all()
         )
 
-        payload = message_data.get(message_type, [])
-
-        # Create Message entry
-        message = Message(
-            app_id=db_app.id,
-            contact_id=sender.id,
-            from_number=sender_wa_id,
-            to_number=receiver_number,
-            message_type=message_type,
-            payload=payload,
-            direction="inbound",
-            status="sent",
-            sent_at=timestamp,
-            created_at=datetime.utcnow(),
+    messages = []
+    for row in rows:
+        if not row["message_id"]:
+            result = await db.execute(insert(Message).values(row))
+            messages.append(Message(id=result.lastrowid, **row))
+        elif row["message_id"] in ids:
+            messages.append(Message(id=ids[row["message_id"]], **row))
+    return messages
+
+
+async def broadcast_ingested(ingested: list, conversations: list):
+    # Small delta events built from what ingestion already holds in memory:
+    # one message.created per message, one conversation.updated per conversation
+    for message, _ in ingested:
+        event = message_created_event(message)
+        await broadcast_to_app(message.app_id, event, contact_topic(event["wa_id"]))
+
+    for conversation, contact_name, wa_id in conversations:
+        await broadcast_to_app(
+            conversation.app_id,
+            conversation_updated_event(conversation, contact_name, wa_id),
+            CONVERSATIONS_TOPIC,
         )
-        db.add(message)
-        db.commit()
-        db.refresh(message)
 
-        result = await get_recent_conversations_ws(db, db_app.id)
-        await broadcast_to_app(db_app.id, result)
 
-        msg_result = await get_messages_by_contact_ws(db, db_app.id, sender_wa_id)
-        await broadcast_to_app(db_app.id, msg_result)
+async def process_webhook_batch(bodies: list):
+    # Queue worker handler: merge the queued deliveries and ingest them together
+    payloads = [json.loads(body) for body in bodies]
+    data = {"entry": [entry for p in payloads for entry in p.get("entry", [])]}
+
+    async with AsyncSessionLocal() as db:
+        ingested, conversations = await ingest_webhook_payload(db, data)
+    await broadcast_ingested(ingested, conversations)
+
+
+@router.post("/webhook")
+async def webhook(request: Request, db: AsyncSession = Depends(get_async_db)):
+    # Fast-ack mode: persist the raw body and let the queue workers ingest it
+    if config.get("webhook_ingest_mode", "sync") == "queue":
+        await webhook_queue.enqueue(await request.body())
+        return {"status": "queued"}
+
+    try:
+        data = await request.json()
+        ingested, conversations = await ingest_webhook_payload(db, data)
+        await broadcast_ingested(ingested, conversations)
 
-        return {"status": "success", "message_id": message.id}
+        return {"status": "success", "count": len(ingested)}
 
+    except HTTPException:
+        # 400/404 are final for the provider; only unexpected errors become 500
+        raise
     except KeyError as e:
         raise HTTPException(status_code=400, detail=f"Invalid request format: {str(e)}")
     except Exception as e:
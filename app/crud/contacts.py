@@ -1,16 +1,73 @@
-from sqlalchemy.orm import Session
-from models import Contact, Tag
+from datetime import datetime
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from models import Contact, Tag, contact_tags
 from schemas import ContactCreate, ContactUpdate
 
 
 def get_contact(db: Session, contact_id: int):
-    return db.query(Contact).filter(Contact.id == contact_id).first()
+    # Tags come with the contact (one extra IN query), as ContactRead needs them
+    return db.scalar(
+        select(Contact)
+        .options(selectinload(Contact.tags))
+        .where(Contact.id == contact_id)
+    )
 
 
 def get_all_contacts(db: Session, skip: int = 0, limit: int = 100):
     return db.query(Contact).offset(skip).limit(limit).all()
 
 
+def contacts_query(
+    app_id: int,
+    tag_id: int = None,
+    opted_in: bool = None,
+    is_active: bool = None,
+    source: str = None,
+    last_active_from: datetime = None,
+    last_active_to: datetime = None,
+    name_prefix: str = None,
+    number_prefix: str = None,
+):
+    # Contacts of one app matching the filters, newest first; every filter has
+    # an (app_id, column) index (see tests/test_query_plans.py)
+    query = (
+        select(Contact)
+        .options(selectinload(Contact.tags))
+        .where(Contact.app_id == app_id)
+    )
+    if tag_id is not None:
+        query = query.join(
+            contact_tags, contact_tags.c.contact_id == Contact.id
+        ).where(contact_tags.c.tag_id == tag_id)
+    if opted_in is not None:
+        query = query.where(Contact.opted_in == opted_in)
+    if is_active is not None:
+        query = query.where(Contact.is_active == is_active)
+    if source is not None:
+        query = query.where(Contact.source == source)
+    if last_active_from is not None:
+        query = query.where(Contact.last_active_at >= last_active_from)
+    if last_active_to is not None:
+        query = query.where(Contact.last_active_at < last_active_to)
+    if name_prefix:
+        query = query.where(Contact.name.like(prefix_pattern(name_prefix), escape="/"))
+    if number_prefix:
+        query = query.where(
+            Contact.wa_id.like(prefix_pattern(number_prefix.lstrip("+")), escape="/")
+        )
+    return query.order_by(Contact.id.desc())
+
+
+def prefix_pattern(prefix: str) -> str:
+    # A literal LIKE 'abc%' (built here, not in SQL) so MySQL can range-scan the index
+    for char in ("/", "%", "_"):
+        prefix = prefix.replace(char, "/" + char)
+    return prefix + "%"
+
+
 def create_contact(db: Session, contact_in: ContactCreate):
     contact = Contact(**contact_in.dict())
     db.add(contact)
@@ -44,3 +101,33 @@ def update_opted_in_status(db: Session, contact_id: int, status: bool):
     db.commit()
     db.refresh(db_contact)
     return db_contact
+
+
+async def upsert_contacts(db: AsyncSession, contacts: list) -> dict:
+    """
+    Upsert inbound senders for batched ingestion.
+
+    `contacts` is a list of dicts with app_id, wa_id, mobile_number,
+    country_code, name and last_active_at. All rows go out as one multi-row
+    upsert on an AsyncSession, then the ids are read back with one query on
+    the unique (app_id, wa_id) index: LAST_INSERT_ID() only reports one id
+    per statement, and callers also need the stored names. Existing contacts
+    are left untouched (their activity goes through the activity buffer).
+    Returns a dict mapping (app_id, wa_id) to a row with the contact's id and
+    name.
+    """
+    if not contacts:
+        return {}
+
+    stmt = mysql_insert(Contact.__table__)
+    stmt = stmt.on_duplicate_key_update(wa_id=stmt.inserted.wa_id)
+    await db.execute(stmt, contacts)
+
+    keys = [(c["app_id"], c["wa_id"]) for c in contacts]
+    rows = await db.execute(
+        select(Contact.id, Contact.app_id, Contact.wa_id, Contact.name).where(
+            tuple_(Contact.app_id, Contact.wa_id).in_(keys)
+        )
+    )
+    return {(row.app_id, row.wa_id): row for row in rows}
+
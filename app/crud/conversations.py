@@ -0,0 +1,151 @@
+from datetime import datetime
+from sqlalchemy import and_, case, desc, func, or_, select, tuple_, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from models import Contact, Conversation, Message
+
+PREVIEW_LENGTH = 255
+
+
+def message_preview(message_type: str, payload) -> str:
+    # Short text shown in the inbox: the body of text messages, the caption of media
+    if isinstance(payload, dict):
+        text = payload.get("body") or payload.get("caption")
+        if isinstance(text, str):
+            return text[:PREVIEW_LENGTH]
+    return None
+
+
+def summary_rows(messages: list) -> list:
+    """
+    One summary row per (app_id, contact_id) for a batch of new messages.
+
+    Each row carries the latest message of the batch (by sent_at, then id)
+    and the number of inbound messages to add to the unread count.
+    """
+    rows = {}
+    for message in messages:
+        key = (message.app_id, message.contact_id)
+        row = rows.get(key)
+        unread = row["unread_count"] if row else 0
+        if message.direction == "inbound":
+            unread += 1
+        if row is None or (message.sent_at, message.id or 0) >= (
+            row["last_sent_at"],
+            row["last_message_id"] or 0,
+        ):
+            row = rows[key] = {
+                "app_id": message.app_id,
+                "contact_id": message.contact_id,
+                "last_message_id": message.id,
+                "last_message_type": message.message_type,
+                "last_message_preview": message_preview(
+                    message.message_type, message.payload
+                ),
+                "last_message_status": message.status,
+                "last_sent_at": message.sent_at,
+                "updated_at": datetime.utcnow(),
+            }
+        row["unread_count"] = unread
+    return list(rows.values())
+
+
+def upsert_summaries_stmt():
+    """
+    INSERT ... ON DUPLICATE KEY UPDATE for rows from `summary_rows`.
+
+    Execute it with the rows in the transaction that inserts the messages.
+    The last_* columns only move forward, so batches committing out of
+    order can't regress a conversation; unread counts are added up.
+    MySQL applies the assignments left to right, so the last message id is
+    replaced before last_sent_at, which then follows it.
+    """
+    table = Conversation.__table__
+    stmt = mysql_insert(table)
+    new = stmt.inserted
+    newer = or_(
+        table.c.last_sent_at.is_(None),
+        new.last_sent_at > table.c.last_sent_at,
+        and_(
+            new.last_sent_at == table.c.last_sent_at,
+            new.last_message_id > table.c.last_message_id,
+        ),
+    )
+
+    def if_newer(name):
+        return (name, case((newer, new[name]), else_=table.c[name]))
+
+    return stmt.on_duplicate_key_update(
+        [
+            if_newer("last_message_type"),
+            if_newer("last_message_preview"),
+            if_newer("last_message_status"),
+            if_newer("last_message_id"),
+            (
+                "last_sent_at",
+                case(
+                    (table.c.last_message_id == new.last_message_id, new.last_sent_at),
+                    else_=table.c.last_sent_at,
+                ),
+            ),
+            ("unread_count", table.c.unread_count + new.unread_count),
+            ("updated_at", new.updated_at),
+        ]
+    )
+
+
+def sync_status_stmt(message_ids: list):
+    # Copy the status of messages that are the last of their conversation
+    # (multi-table UPDATE on MySQL), after their status changed
+    return (
+        update(Conversation)
+        .where(
+            Conversation.last_message_id == Message.id,
+            Message.message_id.in_(message_ids),
+        )
+        .values(last_message_status=Message.status, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+
+
+def status_change_stmt(message: Message, was_unread: bool):
+    # Status change of one message: keep its summary in step and, if it was an
+    # unread inbound message, take it off the unread count
+    values = {
+        Conversation.last_message_status: case(
+            (Conversation.last_message_id == message.id, message.status),
+            else_=Conversation.last_message_status,
+        ),
+        Conversation.updated_at: datetime.utcnow(),
+    }
+    if was_unread:
+        values[Conversation.unread_count] = (
+            func.greatest(Conversation.unread_count, 1) - 1
+        )
+    return (
+        update(Conversation)
+        .where(
+            Conversation.app_id == message.app_id,
+            Conversation.contact_id == message.contact_id,
+        )
+        .values(values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def inbox_query(app_id: int):
+    # Indexed range read on (app_id, last_sent_at), newest conversation first
+    return (
+        select(Conversation, Contact.name, Contact.wa_id)
+        .join(Contact, Contact.id == Conversation.contact_id)
+        .where(Conversation.app_id == app_id)
+        .order_by(desc(Conversation.last_sent_at), desc(Conversation.id))
+    )
+
+
+def summaries_query(keys: list):
+    # Summary rows of the given (app_id, contact_id) pairs, as `inbox_query` rows
+    return (
+        select(Conversation, Contact.name, Contact.wa_id)
+        .join(Contact, Contact.id == Conversation.contact_id)
+        .where(tuple_(Conversation.app_id, Conversation.contact_id).in_(keys))
+    )
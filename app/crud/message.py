@@ -1,75 +1,103 @@
-from sqlalchemy.orm import Session
-from models import App, Contact, Message
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Contact, Message
 from utils import human_readable_time_diff
-from sqlalchemy import func, desc, asc, and_
+from sqlalchemy import asc, desc, select
 from datetime import datetime
 from fastapi.encoders import jsonable_encoder
 from schemas import MessageCreate
 from app.services.message_service import send_message_via_gupshup
+from app.services.app_registry import app_registry
+from app.services.activity_buffer import activity_buffer
+from app.crud.conversations import inbox_query, summary_rows, upsert_summaries_stmt
+from app.crud.pagination import encode_cursor, decode_cursor
 
+# Largest history page a client may ask for
+HISTORY_MAX_LIMIT = 100
 
-async def get_recent_conversations_ws(db: Session, app_id: int):
-    app = db.query(App).filter(App.id == app_id).first()
-    if not app:
-        return {"error": "App not found"}
 
-    subq = (
-        db.query(Message.contact_id, func.max(Message.sent_at).label("last_sent_at"))
-        .filter(Message.app_id == app_id)
-        .group_by(Message.contact_id)
-        .subquery()
-    )
+def serialize_message(m):
+    return {
+        "id": m.id,
+        "app_id": m.app_id,
+        "contact_id": m.contact_id,
+        "message_id": m.message_id,
+        "from_number": m.from_number,
+        "to_number": m.to_number,
+        "message_type": m.message_type,
+        "payload": m.payload,
+        "direction": m.direction,
+        "status": m.status,
+        "sent_at": m.sent_at.isoformat() if m.sent_at else None,
+        "received_at": m.received_at.isoformat() if m.received_at else None,
+        "read_at": m.read_at.isoformat() if m.read_at else None,
+        "created_at": m.created_at.isoformat() if m.created_at else None,
+    }
 
-    last_messages = (
-        db.query(
-            Message,
-            Contact.name.label("contact_name"),
-            Contact.wa_id.label("wa_id"),
-        )
-        .join(
-            subq,
-            and_(
-                Message.contact_id == subq.c.contact_id,
-                Message.sent_at == subq.c.last_sent_at,
-            ),
-        )
-        .join(Contact, Contact.id == Message.contact_id)
-        .order_by(desc(Message.sent_at))
-        .all()
-    )
 
-    # Prepare response
-    conversations = []
-    for msg, contact_name, wa_id in last_messages:
-        display_name = contact_name or wa_id
-        time_display = human_readable_time_diff(msg.sent_at)
-
-        conversations.append(
-            {
-                "wa_id": wa_id,
-                "contact_name": display_name,
-                "last_message_type": msg.message_type,
-                "last_message_time": time_display,
-            }
-        )
+def serialize_conversation(conversation, contact_name, wa_id):
+    # One inbox row, read from the conversations summary table
+    return {
+        "wa_id": wa_id,
+        "contact_name": contact_name or wa_id,
+        "last_message_type": conversation.last_message_type,
+        "last_message_time": (
+            human_readable_time_diff(conversation.last_sent_at)
+            if conversation.last_sent_at
+            else None
+        ),
+        "last_message_preview": conversation.last_message_preview,
+        "last_message_status": conversation.last_message_status,
+        "unread_count": conversation.unread_count,
+    }
+
 
-    return {"conversations": conversations}
+def conversation_wa_id(message: Message) -> str:
+    # The contact side of a message, whichever direction it went
+    if message.direction == "inbound":
+        return message.from_number
+    return message.to_number
 
 
-async def get_contact_by_by_id_ws(db: Session, app_id: int, wa_id: str):
-    app = db.query(App).filter(App.id == app_id).first()
+def message_created_event(message: Message) -> dict:
+    # Delta event for a single new message, routed by the conversation's wa_id
+    return {
+        "type": "message.created",
+        "wa_id": conversation_wa_id(message),
+        "message": serialize_message(message),
+    }
+
+
+def conversation_updated_event(conversation, contact_name, wa_id) -> dict:
+    # Delta event carrying the single inbox row affected, in the snapshot's shape
+    return {
+        "type": "conversation.updated",
+        "conversation": serialize_conversation(conversation, contact_name, wa_id),
+    }
+
+
+async def get_recent_conversations_ws(db: AsyncSession, app_id: int):
+    app = await app_registry.aget_by_id(app_id)
+    if not app:
+        return {"error": "App not found"}
+
+    rows = await db.execute(inbox_query(app_id))
+    return {"conversations": [serialize_conversation(*row) for row in rows]}
+
+
+async def get_contact_by_by_id_ws(db: AsyncSession, app_id: int, wa_id: str):
+    app = await app_registry.aget_by_id(app_id)
     if not app:
         return {"error": "App not found", "messages": []}
 
     # Fetch profile (Contact)
-    contact = (
-        db.query(Contact)
-        .filter(Contact.app_id == app_id, Contact.wa_id == wa_id)
-        .first()
+    contact = await db.scalar(
+        select(Contact).where(Contact.app_id == app_id, Contact.wa_id == wa_id)
     )
     if not contact:
         return {"error": "Contact not found", "messages": []}
 
+    last_active_at = activity_buffer.last_active_at(contact.id, contact.last_active_at)
+
     return {
         "type": "contact",
         "contact": {
@@ -79,9 +107,7 @@ async def get_contact_by_by_id_ws(db: Session, app_id: int, wa_id: str):
             "number": contact.wa_id,
             "source": contact.source,
             "is_active": contact.is_active,
-            "last_active_at": (
-                contact.last_active_at.isoformat() if contact.last_active_at else None
-            ),
+            "last_active_at": last_active_at.isoformat() if last_active_at else None,
             "created_at": (
                 contact.created_at.isoformat() if contact.created_at else None
             ),
@@ -89,51 +115,105 @@ async def get_contact_by_by_id_ws(db: Session, app_id: int, wa_id: str):
     }
 
 
+def history_position(cursor: str = None, before_id: int = None, after_id: int = None):
+    # (before_id, after_id) from an opaque cursor or the explicit ids
+    if cursor:
+        position = decode_cursor(cursor)
+        before_id, after_id = position.get("before_id"), position.get("after_id")
+    if before_id is not None:
+        before_id = int(before_id)
+    if after_id is not None:
+        after_id = int(after_id)
+    return before_id, after_id
+
+
+def history_query(
+    app_id: int,
+    contact_id: int,
+    limit: int,
+    before_id: int = None,
+    after_id: int = None,
+    offset: int = 0,
+):
+    """
+    Keyset page of one conversation on the (app_id, contact_id, id) index.
+
+    Without a position it reads the newest messages; `before_id` scrolls back
+    and `after_id` catches up on newer ones. One extra row is read to tell
+    whether another page exists in that direction, so no COUNT is needed.
+    `offset` only serves clients still paging by offset from the newest.
+    """
+    query = select(Message).where(
+        Message.app_id == app_id, Message.contact_id == contact_id
+    )
+    if after_id is not None:
+        query = query.where(Message.id > after_id).order_by(asc(Message.id))
+        return query.limit(limit + 1)
+    if before_id is not None:
+        query = query.where(Message.id < before_id)
+    elif offset:
+        query = query.offset(offset)
+    return query.order_by(desc(Message.id)).limit(limit + 1)
+
+
+def history_page(
+    messages: list, limit: int, before_id: int = None, after_id: int = None
+):
+    # Oldest-to-newest page plus cursors for the older and newer neighbours
+    more = len(messages) > limit
+    messages = messages[:limit]
+    if after_id is None:
+        messages.reverse()
+        has_older, has_newer = more, before_id is not None
+    else:
+        has_older, has_newer = True, more
+
+    prev_cursor = next_cursor = None
+    if messages and has_older:
+        prev_cursor = encode_cursor({"before_id": messages[0].id})
+    if messages and has_newer:
+        next_cursor = encode_cursor({"after_id": messages[-1].id})
+    return messages, prev_cursor, next_cursor
+
+
+def history_limit(limit) -> int:
+    return min(max(int(limit), 1), HISTORY_MAX_LIMIT)
+
+
 async def get_messages_by_contact_ws(
-    db: Session, app_id: int, wa_id: str, offset: int = 0, limit: int = 30
+    db: AsyncSession,
+    app_id: int,
+    wa_id: str,
+    offset: int = 0,
+    limit: int = 30,
+    cursor: str = None,
+    before_id: int = None,
+    after_id: int = None,
 ):
-    app = db.query(App).filter(App.id == app_id).first()
+    app = await app_registry.aget_by_id(app_id)
     if not app:
         return {"error": "App not found", "messages": []}
 
-    contact = db.query(Contact).filter(Contact.wa_id == wa_id).first()
+    # Bad paging input gets an error reply, not an exception that ends the socket
+    try:
+        before_id, after_id = history_position(cursor, before_id, after_id)
+        limit = history_limit(limit)
+        offset = max(int(offset or 0), 0)
+    except (TypeError, ValueError):
+        return {"error": "Invalid cursor", "messages": []}
+
+    contact = await db.scalar(
+        select(Contact).where(Contact.app_id == app_id, Contact.wa_id == wa_id)
+    )
     if not contact:
         return {"error": "Contact not found", "messages": []}
 
-    total_messages = (
-        db.query(func.count(Message.id))
-        .filter(Message.app_id == app_id, Message.contact_id == contact.id)
-        .scalar()
+    rows = await db.scalars(
+        history_query(app_id, contact.id, limit, before_id, after_id, offset)
     )
-
-    # Calculate reverse offset: start from the most recent
-    reverse_offset = max(total_messages - offset - limit, 0)
-
-    messages_query = (
-        db.query(Message)
-        .filter(Message.app_id == app_id, Message.contact_id == contact.id)
-        .order_by(asc(Message.created_at))  # Oldest to newest
-        .offset(reverse_offset)
-        .limit(limit)
+    messages, prev_cursor, next_cursor = history_page(
+        list(rows), limit, before_id, after_id
     )
-    messages = messages_query.all()
-
-    def serialize_message(m):
-        return {
-            "id": m.id,
-            "app_id": m.app_id,
-            "contact_id": m.contact_id,
-            "from_number": m.from_number,
-            "to_number": m.to_number,
-            "message_type": m.message_type,
-            "payload": m.payload,
-            "direction": m.direction,
-            "status": m.status,
-            "sent_at": m.sent_at.isoformat() if m.sent_at else None,
-            "received_at": m.received_at.isoformat() if m.received_at else None,
-            "read_at": m.read_at.isoformat() if m.read_at else None,
-            "created_at": m.created_at.isoformat() if m.created_at else None,
-        }
 
     serialized_messages = [serialize_message(m) for m in messages]
 
@@ -141,18 +221,24 @@ async def get_messages_by_contact_ws(
         "type": "messages",
         "messages": serialized_messages,
         "count": len(serialized_messages),
+        "prev_cursor": prev_cursor,
+        "next_cursor": next_cursor,
     }
 
 
 async def handle_send_message(
-    db: Session, message_in: MessageCreate
+    db: AsyncSession, message_in: MessageCreate
 ):
     # Validate app
-    db_app = db.query(App).filter(App.id == message_in.app_id).first()
+    db_app = await app_registry.aget_by_id(message_in.app_id)
     if not db_app:
         return {"error": "App not found"}
 
-    db_contact = db.query(Contact).filter(Contact.wa_id == message_in.to_number).first()
+    db_contact = await db.scalar(
+        select(Contact).where(
+            Contact.app_id == db_app.id, Contact.wa_id == message_in.to_number
+        )
+    )
     if not db_contact:
         return {"error": "Contact not found", "messages": []}
 
@@ -176,16 +262,25 @@ async def handle_send_message(
         read_at=read_at,
     )
     db.add(db_msg)
-    db.commit()
-    db.refresh(db_msg)
+    await db.flush()
+    await db.execute(upsert_summaries_stmt(), summary_rows([db_msg]))
+    # The commit hands the connection back to the pool, and nothing touches the
+    # session until the provider answers (every field is known since the flush
+    # and expire_on_commit is off), so no connection is held during the call
+    await db.commit()
 
     # Send via Gupshup
     try:
-        await send_message_via_gupshup(db_msg)
+        provider_message_id = await send_message_via_gupshup(db_msg)
     except Exception as e:
         print(e)
         raise e
 
+    if provider_message_id:
+        # Short second transaction to store the provider id
+        db_msg.message_id = provider_message_id
+        await db.commit()
+
     msg_data = jsonable_encoder(db_msg)
 
     return {
@@ -0,0 +1,72 @@
+from datetime import datetime
+
+from sqlalchemy import case, func
+from sqlalchemy.orm.attributes import set_committed_value
+
+from config import config
+from models import Contact
+from app.services.write_behind import WriteBehindBuffer
+
+
+class ActivityBuffer(WriteBehindBuffer):
+    """
+    Write-behind buffer for `Contact.last_active_at`.
+
+    Inbound messages only record the latest activity time per contact in
+    memory; every `interval` seconds all dirty contacts are written with one
+    UPDATE, and the buffer is flushed on shutdown. Reads that need a fresh
+    value merge the buffered timestamp with the stored one.
+    """
+
+    name = "Activity"
+
+    def __init__(self, interval: float = 5.0):
+        super().__init__(interval)
+        self.touches = 0
+
+    def touch(self, contact_id: int, timestamp: datetime):
+        with self._lock:
+            self.touches += 1
+            self.merge(contact_id, timestamp)
+
+    def merge(self, contact_id: int, timestamp: datetime):
+        # Keep the newest value of each contact
+        current = self._pending.get(contact_id)
+        if current is None or timestamp > current:
+            self._pending[contact_id] = timestamp
+
+    def last_active_at(self, contact_id: int, stored: datetime = None):
+        buffered = self._pending.get(contact_id)
+        if buffered is None or (stored is not None and stored > buffered):
+            return stored
+        return buffered
+
+    def apply(self, contacts):
+        # Merge buffered values into loaded contacts without marking them dirty
+        for contact in contacts:
+            merged = self.last_active_at(contact.id, contact.last_active_at)
+            if merged is not contact.last_active_at:
+                set_committed_value(contact, "last_active_at", merged)
+        return contacts
+
+    def write(self, db, pending: dict) -> int:
+        # Never move a contact backwards if another worker flushed a newer value
+        buffered = case(pending, value=Contact.id)
+        return (
+            db.query(Contact)
+            .filter(Contact.id.in_(list(pending)))
+            .update(
+                {
+                    Contact.last_active_at: func.greatest(
+                        func.coalesce(Contact.last_active_at, buffered), buffered
+                    )
+                },
+                synchronize_session=False,
+            )
+        )
+
+    def stats(self) -> dict:
+        return {**super().stats(), "touches": self.touches}
+
+
+activity_buffer = ActivityBuffer(config.get("activity_flush_interval", 5.0))
@@ -0,0 +1,170 @@
+import asyncio
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select
+
+from config import config
+from database import SessionLocal, AsyncSessionLocal
+from models import App
+from app.services.lru import LRUCache
+
+
+class AppSnapshot(NamedTuple):
+    id: int
+    user_id: int
+    business_name: str
+    whatsapp_number: str
+    is_active: bool
+    is_whatsapp_verified: bool
+
+
+APPS_QUERY = select(
+    App.id,
+    App.user_id,
+    App.business_name,
+    App.whatsapp_number,
+    App.is_active,
+    App.is_whatsapp_verified,
+).where(App.deleted_at.is_(None))
+
+
+class AppRegistry:
+    """
+    Process-wide, read-only view of the `apps` table for the hot paths.
+
+    Apps are looked up by WhatsApp number on every webhook and by id on every
+    WebSocket request, but the table is tiny and rarely changes. The registry
+    loads it with one query, serves immutable snapshots from memory and
+    reloads when `ttl` seconds have passed or when the app handlers call
+    `invalidate()`. Other workers pick up changes within `ttl`, and a miss
+    triggers an early reload (at most once per `miss_reload_interval`) so a
+    newly created app is found without waiting for the TTL. A key that still
+    misses after a reload is remembered for `negative_ttl`, so a stream of
+    deliveries for an unknown number doesn't reload on every request.
+
+    Code on the event loop uses the `aget_*` lookups, which reload on the
+    async engine; sync routes (threadpool) use `get_*`. Either way only one
+    reload runs at a time, concurrent callers wait for it and reuse it.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 60.0,
+        miss_reload_interval: float = 1.0,
+        negative_ttl: float = 30.0,
+    ):
+        self.ttl = ttl
+        self.miss_reload_interval = miss_reload_interval
+        self.negative_ttl = negative_ttl
+        self._by_id = {}
+        self._by_number = {}
+        self._loaded_at = 0.0
+        self._unknown = LRUCache(10000)
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._async_reload_lock = asyncio.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def _install(self, rows):
+        snapshots = [AppSnapshot(*row) for row in rows]
+        with self._lock:
+            self._by_id = {s.id: s for s in snapshots}
+            self._by_number = {s.whatsapp_number: s for s in snapshots}
+            self._loaded_at = time.monotonic()
+            self.reloads += 1
+
+    def reload(self, not_before: float = None):
+        # `not_before`: skip if another caller reloaded since that time
+        with self._reload_lock:
+            if not_before is not None and self._loaded_at > not_before:
+                return
+            db = SessionLocal()
+            try:
+                rows = db.execute(APPS_QUERY).all()
+            finally:
+                db.close()
+            self._install(rows)
+
+    async def areload(self, not_before: float = None):
+        async with self._async_reload_lock:
+            if not_before is not None and self._loaded_at > not_before:
+                return
+            async with AsyncSessionLocal() as db:
+                rows = (await db.execute(APPS_QUERY)).all()
+            self._install(rows)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = 0.0
+        self._unknown = LRUCache(10000)
+
+    def _stale(self) -> bool:
+        return time.monotonic() - self._loaded_at > self.ttl
+
+    def _should_reload_miss(self, index: str, key) -> bool:
+        now = time.monotonic()
+        missed_at = self._unknown.get((index, key))
+        if missed_at is not None and now - missed_at < self.negative_ttl:
+            return False
+        return now - self._loaded_at > self.miss_reload_interval
+
+    def _result(self, index: str, key, snapshot) -> Optional[AppSnapshot]:
+        if snapshot is None:
+            self.misses += 1
+            self._unknown.put((index, key), time.monotonic())
+        else:
+            self.hits += 1
+        return snapshot
+
+    def _lookup(self, index: str, key) -> Optional[AppSnapshot]:
+        if self._stale():
+            self.reload(not_before=self._loaded_at)
+        snapshot = getattr(self, index).get(key)
+        if snapshot is None and self._should_reload_miss(index, key):
+            self.reload(not_before=self._loaded_at)
+            snapshot = getattr(self, index).get(key)
+        return self._result(index, key, snapshot)
+
+    async def _alookup(self, index: str, key) -> Optional[AppSnapshot]:
+        if self._stale():
+            await self.areload(not_before=self._loaded_at)
+        snapshot = getattr(self, index).get(key)
+        if snapshot is None and self._should_reload_miss(index, key):
+            await self.areload(not_before=self._loaded_at)
+            snapshot = getattr(self, index).get(key)
+        return self._result(index, key, snapshot)
+
+    def get_by_id(self, app_id: int) -> Optional[AppSnapshot]:
+        return self._lookup("_by_id", int(app_id))
+
+    def get_by_number(self, whatsapp_number: str) -> Optional[AppSnapshot]:
+        return self._lookup("_by_number", whatsapp_number)
+
+    async def aget_by_id(self, app_id: int) -> Optional[AppSnapshot]:
+        return await self._alookup("_by_id", int(app_id))
+
+    async def aget_by_number(self, whatsapp_number: str) -> Optional[AppSnapshot]:
+        return await self._alookup("_by_number", whatsapp_number)
+
+    def stats(self) -> dict:
+        return {
+            "apps": len(self._by_id),
+            "age_seconds": round(time.monotonic() - self._loaded_at, 3)
+            if self._loaded_at
+            else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "unknown_keys": len(self._unknown),
+            "reloads": self.reloads,
+        }
+
+
+app_registry = AppRegistry(
+    config.get("app_registry_ttl", 60.0),
+    negative_ttl=config.get("app_registry_negative_ttl", 30.0),
+)
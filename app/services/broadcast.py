@@ -0,0 +1,151 @@
+import asyncio
+import json
+
+from config import config
+from connection_pool import hub
+
+
+class LocalBroadcast:
+    """
+    In-process backend: events only reach sockets held by this worker.
+
+    Fine for a single uvicorn process, which is the default deployment.
+    """
+
+    name = "local"
+
+    def __init__(self):
+        self.published = 0
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, app_id: int, message, topic: str = None):
+        self.published += 1
+        message = {**message, "seq": hub.next_seq(int(app_id))}
+        hub.publish(app_id, message, topic)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "published": self.published}
+
+
+# Stamp and publish in one atomic step: INCR then PUBLISH "<seq>:<envelope>", so
+# every subscriber receives an app's events in sequence order
+PUBLISH_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('PUBLISH', KEYS[2], seq .. ':' .. ARGV[1])
+return seq
+"""
+
+
+class RedisBroadcast:
+    """
+    Cross-process backend over Redis pub/sub (or any server speaking its protocol).
+
+    Every worker publishes events to one channel and subscribes to it; each
+    received event is handed to the local hub, which only fans out to the
+    sockets this worker holds. The publishing worker gets its own events back
+    through the subscription, so delivery is uniform across workers. Event
+    sequence numbers come from one Redis counter per app, shared by all workers,
+    and are assigned in the same script that publishes the event, so two
+    workers can't publish out of sequence order.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, channel: str):
+        self.url = url
+        self.channel = channel
+        self._redis = None
+        self._publish = None
+        self._listener = None
+
+        self.published = 0
+        self.received = 0
+        self.errors = 0
+
+    async def start(self):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(self.url)
+        self._publish = self._redis.register_script(PUBLISH_SCRIPT)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    async def publish(self, app_id: int, message, topic: str = None):
+        try:
+            # The script adds the seq from the app's shared counter
+            envelope = json.dumps(
+                {"app_id": int(app_id), "topic": topic, "message": message},
+                separators=(",", ":"),
+                ensure_ascii=False,
+            )
+            await self._publish(
+                keys=[f"{self.channel}:seq:{int(app_id)}", self.channel],
+                args=[envelope],
+            )
+            self.published += 1
+        except Exception as e:
+            # Don't lose the event for local sockets if the broker is unreachable;
+            # stamped locally like LocalBroadcast, so it enters the replay buffer
+            self.errors += 1
+            print(f"Broadcast publish failed: {e}")
+            message = {**message, "seq": hub.next_seq(int(app_id))}
+            hub.publish(app_id, message, topic)
+
+    async def _listen(self):
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                async for item in pubsub.listen():
+                    if item.get("type") != "message":
+                        continue
+                    seq, _, data = item["data"].partition(b":")
+                    envelope = json.loads(data)
+                    message = {**envelope["message"], "seq": int(seq)}
+                    self.received += 1
+                    hub.publish(envelope["app_id"], message, envelope.get("topic"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                print(f"Broadcast subscription lost, reconnecting: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "channel": self.channel,
+            "published": self.published,
+            "received": self.received,
+            "errors": self.errors,
+        }
+
+
+def create_broadcast():
+    backend = config.get("broadcast_backend", "local")
+    if backend == "redis":
+        return RedisBroadcast(
+            config.get("redis_url", "redis://localhost:6379/0"),
+            config.get("broadcast_channel", "chatbot:broadcast"),
+        )
+    if backend != "local":
+        raise ValueError(f"Unknown broadcast_backend: {backend}")
+    return LocalBroadcast()
+
+
+broadcaster = create_broadcast()
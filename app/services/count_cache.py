@@ -0,0 +1,39 @@
+import time
+
+from config import config
+from app.services.lru import LRUCache
+
+
+class CountCache(LRUCache):
+    """
+    Short-lived cache of COUNT(*) results for list endpoints.
+
+    Totals are only an indication for pagers, so a count taken up to `ttl`
+    seconds ago is returned instead of counting again on every page.
+    Bounded LRU, keyed by whatever identifies the filtered query.
+    """
+
+    def __init__(self, ttl: float = 60.0, maxsize: int = 10000):
+        super().__init__(maxsize)
+        self.ttl = ttl
+
+    def get_or_count(self, key, count):
+        # `count` is called to compute the total on a miss or once it is stale
+        now = time.monotonic()
+        cached = self.get(key)
+        if cached is not None and now - cached[1] < self.ttl:
+            return cached[0]
+        if cached is not None:
+            # Stale: count as a miss, not the hit the LRU recorded
+            self.hits -= 1
+            self.misses += 1
+
+        total = count()
+        self.put(key, (total, now))
+        return total
+
+    def stats(self) -> dict:
+        return {**super().stats(), "ttl": self.ttl}
+
+
+contact_count_cache = CountCache(config.get("contacts_total_cache_ttl", 60.0))
@@ -0,0 +1,22 @@
+from config import config
+from app.services.lru import LRUCache
+
+
+class RecentIds(LRUCache):
+    """
+    Bounded LRU set of recently seen provider message ids.
+
+    Sits in front of the unique index on `messages.message_id` so that webhook
+    retries are rejected with a hash lookup instead of a database round trip.
+    Only ids that are known to be stored are added, so a miss here is never
+    wrong, it just falls through to the database check.
+    """
+
+    def __contains__(self, message_id: str) -> bool:
+        return self.get(message_id, False)
+
+    def add_many(self, message_ids):
+        self.put_many((message_id, True) for message_id in message_ids)
+
+
+recent_message_ids = RecentIds(config.get("webhook_dedupe_cache_size", 100000))
@@ -63,8 +63,13 @@ async def send_message_via_gupshup(message: Message):
 
     print("Sending to Gupshup:", payload)
 
+    # Async client so a slow Gupshup call doesn't block other WebSocket requests
     try:
-        response = httpx.post(GUPSHUP_API_URL, data=payload, headers=headers)
+        async with httpx.AsyncClient() as client:
+            response = await client.post(GUPSHUP_API_URL, data=payload, headers=headers)
         response.raise_for_status()
     except httpx.HTTPStatusError as e:
         raise HTTPException(status_code=502, detail=f"Gupshup error: {e.response.text}")
+
+    # Provider message id, used to match the status callbacks for this message
+    return response.json().get("messageId")
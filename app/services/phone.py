@@ -0,0 +1,99 @@
+import phonenumbers
+from phonenumbers import geocoder
+
+from config import config
+from app.services.lru import LRUCache
+
+
+def _build_calling_code_table() -> dict:
+    """
+    Map each calling code owned by a single region to (country_iso, country_name).
+
+    Calling codes are prefix-free, so the first 1-3 digits of a wa_id identify
+    the code without running the full parser. Codes shared by several regions
+    (+1, +7, +44, ...) are left out and still go through `phonenumbers.parse`.
+    Building the table loads the metadata of every region (about 0.4s), so it
+    is done once per process, at import time. `uvicorn --workers` spawns fresh
+    interpreters, so each worker builds its own copy; to build it once and
+    share it, run gunicorn with uvicorn workers and `--preload`, which imports
+    the app in the master before forking.
+    """
+    table = {}
+    for code, regions in phonenumbers.COUNTRY_CODE_TO_REGION_CODE.items():
+        if len(regions) != 1 or regions[0] == phonenumbers.UNKNOWN_REGION:
+            continue
+        region = regions[0]
+        example = phonenumbers.example_number(region)
+        if example is None:
+            continue
+        table[str(code)] = (region, geocoder.country_name_for_number(example, "en"))
+    # Warm the geocoder data used by the slow path as well
+    geocoder.description_for_number(phonenumbers.parse("+14155550100"), "en")
+    return table
+
+
+CALLING_CODES = _build_calling_code_table()
+
+
+class CountryInfoCache(LRUCache):
+    """Bounded LRU of `extract_country_info` results keyed by wa_id."""
+
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize)
+        self.fast_path = 0
+        self.slow_path = 0
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "fast_path": self.fast_path,
+            "slow_path": self.slow_path,
+        }
+
+
+country_info_cache = CountryInfoCache(config.get("phone_cache_size", 50000))
+
+
+def _parse_country_info(wa_id: str):
+    for length in (1, 2, 3):
+        known = CALLING_CODES.get(wa_id[:length])
+        if known is not None:
+            country_code = wa_id[:length]
+            country_info_cache.fast_path += 1
+            return {
+                "country_code": country_code,
+                "country_iso": known[0],
+                "country_name": known[1],
+                "local_number": wa_id[length:],
+            }
+
+    country_info_cache.slow_path += 1
+    try:
+        parsed = phonenumbers.parse("+" + wa_id)
+        country_code = str(parsed.country_code)
+        country_iso = phonenumbers.region_code_for_number(parsed)
+        country_name = geocoder.description_for_number(parsed, "en")
+        local_number = (
+            wa_id[len(country_code) :] if wa_id.startswith(country_code) else wa_id
+        )
+        return {
+            "country_code": country_code,
+            "country_iso": country_iso,
+            "country_name": country_name,
+            "local_number": local_number,
+        }
+    except Exception:
+        return {
+            "country_code": "",
+            "country_iso": "",
+            "country_name": "",
+            "local_number": wa_id,
+        }
+
+
+def extract_country_info(wa_id: str):
+    info = country_info_cache.get(wa_id)
+    if info is None:
+        info = _parse_country_info(wa_id)
+        country_info_cache.put(wa_id, info)
+    return info
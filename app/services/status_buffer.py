@@ -0,0 +1,143 @@
+import time
+from datetime import datetime
+
+from sqlalchemy import case, func, select
+
+from config import config
+from models import Message
+from app.crud.conversations import sync_status_stmt
+from app.services.write_behind import WriteBehindBuffer
+
+# Lifecycle order of a message; a later state always wins over an earlier one
+STATUS_ORDER = ("sent", "delivered", "read", "failed")
+
+
+def _earliest(a: datetime, b: datetime):
+    if a is None or (b is not None and b < a):
+        return b
+    return a
+
+
+class StatusBuffer(WriteBehindBuffer):
+    """
+    Coalescing buffer for provider status callbacks (sent/delivered/read/failed).
+
+    Callbacks are collected for `interval` seconds. Several transitions for the
+    same message collapse into the final state, and the whole window is applied
+    with a single UPDATE that also fills `received_at` and `read_at`.
+
+    A callback can beat the send path to the database (the provider answers
+    before `message_id` is stored), so ids that match no row are kept and
+    retried on the following flushes for `retry_window` seconds.
+    """
+
+    name = "Status"
+
+    def __init__(self, interval: float = 1.0, retry_window: float = 60.0):
+        super().__init__(interval)
+        self.retry_window = retry_window
+
+        self.received = 0
+        self.coalesced = 0
+        self.unmatched_retried = 0
+        self.unmatched_dropped = 0
+
+    def add(self, message_id: str, status: str, timestamp: datetime):
+        if status not in STATUS_ORDER:
+            return
+        entry = {
+            "status": status,
+            # A read receipt implies delivery, even if the delivered callback is lost
+            "received_at": timestamp if status in ("delivered", "read") else None,
+            "read_at": timestamp if status == "read" else None,
+            "first_seen": time.monotonic(),
+        }
+        with self._lock:
+            self.received += 1
+            if message_id in self._pending:
+                self.coalesced += 1
+            self.merge(message_id, entry)
+
+    def merge(self, message_id: str, entry: dict):
+        current = self._pending.get(message_id)
+        if current is None:
+            self._pending[message_id] = dict(entry)
+            return
+        if STATUS_ORDER.index(entry["status"]) > STATUS_ORDER.index(current["status"]):
+            current["status"] = entry["status"]
+        for field in ("received_at", "read_at"):
+            current[field] = _earliest(current[field], entry[field])
+        current["first_seen"] = min(current["first_seen"], entry["first_seen"])
+
+    def write(self, db, pending: dict) -> int:
+        received = {k: v["received_at"] for k, v in pending.items() if v["received_at"]}
+        read = {k: v["read_at"] for k, v in pending.items() if v["read_at"]}
+        new_rank = case(
+            {k: STATUS_ORDER.index(v["status"]) + 1 for k, v in pending.items()},
+            value=Message.message_id,
+        )
+        new_status = case(
+            {k: v["status"] for k, v in pending.items()}, value=Message.message_id
+        )
+        values = {
+            # Never move a message backwards if callbacks straddle two windows
+            Message.status: case(
+                (new_rank > func.field(Message.status, *STATUS_ORDER), new_status),
+                else_=Message.status,
+            ),
+        }
+        if received:
+            values[Message.received_at] = func.coalesce(
+                Message.received_at, case(received, value=Message.message_id)
+            )
+        if read:
+            values[Message.read_at] = func.coalesce(
+                Message.read_at, case(read, value=Message.message_id)
+            )
+
+        # rowcount is the number of matched rows (the MySQL dialects set FOUND_ROWS)
+        updated = (
+            db.query(Message)
+            .filter(Message.message_id.in_(list(pending)))
+            .update(values, synchronize_session=False)
+        )
+        # Conversations whose last message changed status, same transaction
+        db.execute(sync_status_stmt(list(pending)))
+        if updated < len(pending):
+            matched = set(
+                db.scalars(
+                    select(Message.message_id).where(
+                        Message.message_id.in_(list(pending))
+                    )
+                )
+            )
+            self._retry_unmatched(
+                {k: v for k, v in pending.items() if k not in matched}
+            )
+        return updated
+
+    def _retry_unmatched(self, unmatched: dict):
+        now = time.monotonic()
+        retry = {}
+        for message_id, entry in unmatched.items():
+            if now - entry["first_seen"] < self.retry_window:
+                retry[message_id] = entry
+            else:
+                self.unmatched_dropped += 1
+        self.unmatched_retried += len(retry)
+        self.requeue(retry)
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "unmatched_retried": self.unmatched_retried,
+            "unmatched_dropped": self.unmatched_dropped,
+        }
+
+
+status_buffer = StatusBuffer(
+    config.get("status_flush_interval", 1.0),
+    config.get("status_retry_window", 60.0),
+)
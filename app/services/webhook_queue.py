@@ -0,0 +1,258 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+from config import config
+
+
+class WebhookQueue:
+    """
+    Durable on-disk queue for raw webhook bodies, backed by SQLite.
+
+    `/webhook` appends the body and acks straight away; a pool of async workers
+    claims batches and hands them to the ingestion handler. A row is deleted
+    only once its batch has been processed, so anything still in the file when
+    the process stops is replayed on the next start. Claims expire after
+    `visibility_timeout` seconds, which also recovers batches held by a crashed
+    worker process sharing the same file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        workers: int = 2,
+        batch_size: int = 100,
+        poll_interval: float = 1.0,
+        visibility_timeout: float = 60.0,
+        max_attempts: int = 5,
+    ):
+        self.path = path
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+
+        self._conn = None
+        self._lock = threading.Lock()
+        self._wakeup = None
+        self._tasks = []
+
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.dead_lettered = 0
+        self.last_batch_size = 0
+        self.last_lag_seconds = 0.0
+
+    def open(self):
+        if self._conn is not None:
+            return
+        conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS webhook_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                body BLOB NOT NULL,
+                enqueued_at REAL NOT NULL,
+                claimed_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS webhook_dead_letters (
+                id INTEGER PRIMARY KEY,
+                body BLOB NOT NULL,
+                enqueued_at REAL NOT NULL,
+                failed_at REAL NOT NULL,
+                error TEXT
+            )
+            """
+        )
+        self._conn = conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # ---------------- storage (blocking, called via to_thread) ---------------- #
+
+    def put(self, body: bytes) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO webhook_queue (body, enqueued_at) VALUES (?, ?)",
+                (body, time.time()),
+            )
+            return cursor.lastrowid
+
+    def claim(self, limit: int) -> list:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    """
+                    SELECT id, body, enqueued_at, attempts FROM webhook_queue
+                    WHERE claimed_at IS NULL OR claimed_at < ?
+                    ORDER BY id LIMIT ?
+                    """,
+                    (now - self.visibility_timeout, limit),
+                ).fetchall()
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE webhook_queue SET claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+                        [(now, row[0]) for row in rows],
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return rows
+
+    def ack(self, ids: list):
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM webhook_queue WHERE id = ?", [(i,) for i in ids]
+            )
+
+    def release(self, ids: list):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE webhook_queue SET claimed_at = NULL WHERE id = ?",
+                [(i,) for i in ids],
+            )
+
+    def dead_letter(self, ids: list, error: str):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for i in ids:
+                    self._conn.execute(
+                        """
+                        INSERT OR REPLACE INTO webhook_dead_letters (id, body, enqueued_at, failed_at, error)
+                        SELECT id, body, enqueued_at, ?, ? FROM webhook_queue WHERE id = ?
+                        """,
+                        (time.time(), error, i),
+                    )
+                    self._conn.execute("DELETE FROM webhook_queue WHERE id = ?", (i,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def stats(self) -> dict:
+        if self._conn is None:
+            return {"enabled": False}
+        with self._lock:
+            depth, in_flight, oldest = self._conn.execute(
+                """
+                SELECT COUNT(*), COUNT(claimed_at), MIN(enqueued_at) FROM webhook_queue
+                """
+            ).fetchone()
+            dead_letters = self._conn.execute(
+                "SELECT COUNT(*) FROM webhook_dead_letters"
+            ).fetchone()[0]
+        return {
+            "enabled": True,
+            "depth": depth,
+            "in_flight": in_flight,
+            "oldest_pending_age_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+            "dead_letters": dead_letters,
+            "workers": len(self._tasks),
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dead_lettered": self.dead_lettered,
+            "last_batch_size": self.last_batch_size,
+            "last_lag_seconds": round(self.last_lag_seconds, 3),
+        }
+
+    # ---------------- async API ---------------- #
+
+    async def enqueue(self, body: bytes) -> int:
+        message_id = await asyncio.to_thread(self.put, body)
+        self.enqueued += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return message_id
+
+    def start(self, handler):
+        """Open the queue file and spawn the worker pool. `handler` is an async
+        callable receiving the list of raw bodies of one batch."""
+        self.open()
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._worker(handler)) for _ in range(self.workers)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.close()
+
+    async def _worker(self, handler):
+        while True:
+            rows = await asyncio.to_thread(self.claim, self.batch_size)
+            if not rows:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await handler([row[1] for row in rows])
+            except asyncio.CancelledError:
+                await asyncio.to_thread(self.release, [row[0] for row in rows])
+                raise
+            except Exception as e:
+                if len(rows) == 1:
+                    await self._fail(rows[0], e)
+                    continue
+                # Retry one by one so a single bad body cannot hold back the batch
+                for row in rows:
+                    try:
+                        await handler([row[1]])
+                    except Exception as e:
+                        await self._fail(row, e)
+                    else:
+                        await self._done([row])
+                continue
+
+            await self._done(rows)
+
+    async def _done(self, rows: list):
+        await asyncio.to_thread(self.ack, [row[0] for row in rows])
+        self.processed += len(rows)
+        self.last_batch_size = len(rows)
+        self.last_lag_seconds = time.time() - min(row[2] for row in rows)
+
+    async def _fail(self, row, error: Exception):
+        self.failed += 1
+        print(f"Webhook queue: message {row[0]} failed: {error}")
+        if row[3] + 1 >= self.max_attempts:
+            await asyncio.to_thread(self.dead_letter, [row[0]], str(error))
+            self.dead_lettered += 1
+        else:
+            await asyncio.to_thread(self.release, [row[0]])
+
+
+webhook_queue = WebhookQueue(
+    config.get("webhook_queue_path", "webhook_queue.db"),
+    workers=config.get("webhook_queue_workers", 2),
+    batch_size=config.get("webhook_queue_batch_size", 100),
+    poll_interval=config.get("webhook_queue_poll_interval", 1.0),
+    visibility_timeout=config.get("webhook_queue_visibility_timeout", 60.0),
+    max_attempts=config.get("webhook_queue_max_attempts", 5),
+)
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+
+from database import SessionLocal
+
+
+class WriteBehindBuffer:
+    """
+    Base of the periodic write-behind buffers.
+
+    Entries are coalesced in memory per key; every `interval` seconds the
+    pending window is swapped out and written in one transaction from a worker
+    thread, and once more on shutdown. If the write fails, the window is merged
+    back into whatever arrived meanwhile so the next flush retries it.
+
+    Subclasses implement `merge(key, entry)` (combine an entry into
+    `_pending`, called with the lock held) and `write(db, pending)` (the SQL,
+    returning the number of rows updated).
+    """
+
+    name = "Write-behind"
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._task = None
+
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.last_flush_size = 0
+
+    def merge(self, key, entry):
+        raise NotImplementedError
+
+    def write(self, db, pending: dict) -> int:
+        raise NotImplementedError
+
+    def requeue(self, pending: dict):
+        with self._lock:
+            for key, entry in pending.items():
+                self.merge(key, entry)
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        db = SessionLocal()
+        try:
+            updated = self.write(db, pending)
+            db.commit()
+        except Exception:
+            db.rollback()
+            self.requeue(pending)
+            raise
+        finally:
+            db.close()
+
+        self.flushes += 1
+        self.flushed_rows += updated
+        self.last_flush_size = len(pending)
+        return updated
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "last_flush_size": self.last_flush_size,
+        }
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print(f"{self.name} buffer flush failed: {e}")
@@ -1,9 +1,20 @@
-from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
-from connection_pool import active_connections
-from models import App, Contact
-from sqlalchemy.orm import Session
-from database import get_db
+import asyncio
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from connection_pool import (
+    hub,
+    Connection,
+    CONVERSATIONS_TOPIC,
+    ENCODINGS,
+    contact_topic,
+    decode_message,
+)
+from database import AsyncSessionLocal, async_read_session
+from dependency import token_pin_key
 from schemas import MessageCreate
+from config import config
+from app.services.app_registry import app_registry
+from app.services.broadcast import broadcaster
 
 from app.crud.message import (
     get_recent_conversations_ws,
@@ -12,97 +23,228 @@ from app.crud.message import (
     handle_send_message
 )
 
-from typing import List
-from collections import defaultdict
-
 router = APIRouter()
 
-# Active WebSocket connections per app_id
-active_connections = defaultdict(list)
+# Requests tagged with an "id" that one socket may have in flight at once
+MAX_INFLIGHT_REQUESTS = config.get("ws_max_inflight_requests", 8)
+
+# Request types that only read, and may be served by a read replica
+READ_REQUESTS = {"conversations", "get_contact", "get_messages"}
 
 
 # 🔥 Real-time WebSocket (filtered by app_id)
 @router.websocket("/ws-test")
-async def websocket_chat(websocket: WebSocket, db: Session = Depends(get_db)):
-    await websocket.accept()
+async def websocket_chat(websocket: WebSocket):
+    encoding, subprotocol = negotiate_encoding(websocket)
+    await websocket.accept(subprotocol=subprotocol)
     app_id = websocket.query_params.get("app_id")
 
     if not app_id:
         await websocket.close(code=1008, reason="Missing app_id")
         return
 
-    app = db.query(App).filter(App.id == int(app_id)).first()
+    app = await app_registry.aget_by_id(int(app_id))
     if not app:
         await websocket.close(code=1008, reason="Invalid app_id")
         return
 
-    active_connections[app_id].append(websocket)
+    user = connection_user(websocket)
+    reason = hub.admit(int(app_id), user)
+    if reason:
+        await websocket.close(code=1013, reason=reason)
+        return
+
+    # Everything sent to this socket goes through its queue and writer task.
+    # ?heartbeat=1 opts in to app-level pings, which the client must answer
+    heartbeat = websocket.query_params.get("heartbeat") == "1"
+    connection = hub.register(websocket, int(app_id), encoding, user, heartbeat)
+
+    # Optional comma-separated topics, subscribed before any event is delivered
+    topics = websocket.query_params.get("topics")
+    if topics:
+        hub.subscribe(connection, requested_topics({"topics": topics.split(",")}))
+
+    # A reconnecting client passes the last seq it saw and gets only the events
+    # it missed; a full snapshot is sent only when the replay buffer can't cover it
+    resume_from = websocket.query_params.get("resume_from", "")
+    if resume_from.isdigit() and not hub.resume(connection, int(resume_from)):
+        await send_resync(connection, int(app_id))
+
+    # Requests carrying an "id" are handled concurrently (up to the cap) and
+    # answered with the same id; untagged requests keep the one-at-a-time flow
+    inflight = set()
+    slots = asyncio.Semaphore(MAX_INFLIGHT_REQUESTS)
 
     try:
         while True:
-            data = await websocket.receive_json()
-            type = data.get("type")
-
-            if type == "conversations":
-                result = await get_recent_conversations_ws(db, int(app_id))
-                await websocket.send_json(result)
-
-            elif type == "get_contact":
-                wa_id = data.get("wa_id")
-                if not wa_id:
-                    await websocket.send_json({"error": "Missing wa_id"})
-                    continue
-                result = await get_contact_by_by_id_ws(
-                    db, int(app_id), wa_id
-                )
-                await websocket.send_json(result)
-
-            elif type == "get_messages":
-                wa_id = data.get("wa_id")
-                offset = data.get("offset") or 0         # Default to 0
-                limit = data.get("limit") or 30         # Default to 30
-
-                if not wa_id:
-                    await websocket.send_json({"error": "Missing wa_id"})
-                    continue
-                result = await get_messages_by_contact_ws(
-                    db, int(app_id), wa_id, offset=offset, limit=limit
-                )
-                await websocket.send_json(result)
-
-            elif type == "send_message":
-                to_number = data.get("to_number")
-                message_type = data.get("message_type")
-                payload = data.get("payload")
-                if not data:
-                    await websocket.send_json({"error": "Missing message payload"})
-                    continue
-
-                message_in = MessageCreate(
-                    app_id=app_id,
-                    to_number=to_number,
-                    message_type=message_type,
-                    payload=payload,
-                )
-
-                result = await handle_send_message(db, message_in)
-                await websocket.send_json(result)
-
-            else:
-                await websocket.send_text(f"Unsupported message type: {type}")
+            data = await receive_request(connection)
+            if data.get("type") == "pong":
+                # Reply to the hub heartbeat; receiving it already marked the socket live
+                continue
+            request_id = data.get("id")
+
+            if request_id is None:
+                result = await handle_request(connection, int(app_id), data)
+                await connection.send(result)
+                continue
+
+            await slots.acquire()
+            task = asyncio.create_task(
+                handle_tagged_request(connection, int(app_id), data, request_id)
+            )
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+            task.add_done_callback(lambda _: slots.release())
 
     except WebSocketDisconnect:
-        active_connections[app_id].remove(websocket)
+        await hub.unregister(connection)
+    except Exception as e:
+        # Only report the error if the socket itself is still usable
+        if connection.alive:
+            await connection.send(f"Error: {str(e)}")
+        await hub.unregister(connection, drain=connection.alive)
+    finally:
+        for task in inflight:
+            task.cancel()
+
+
+def negotiate_encoding(websocket: WebSocket):
+    # A client asks for MessagePack binary frames with the "msgpack" subprotocol
+    # or ?encoding=msgpack; anything else (or msgpack not installed) gets JSON
+    if "msgpack" in ENCODINGS:
+        if "msgpack" in websocket.scope.get("subprotocols", []):
+            return "msgpack", "msgpack"
+        if websocket.query_params.get("encoding") == "msgpack":
+            return "msgpack", None
+    return "json", None
+
+
+def connection_user(websocket: WebSocket) -> str:
+    # Key for the per-user connection cap and read-your-writes pinning: the
+    # token subject when a valid ?token= is passed (the same key as the HTTP
+    # requests of that user). Anonymous sockets get None and are only capped
+    # per app, since behind a proxy they would all share one client address
+    token = websocket.query_params.get("token")
+    return token_pin_key(token) if token else None
+
+
+async def receive_request(connection: Connection):
+    # Requests may arrive as JSON text or MessagePack binary, whatever was negotiated
+    message = await connection.websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    data = message.get("bytes")
+    if data is None:
+        data = message.get("text") or ""
+        connection.touch(len(data.encode()))
+    else:
+        connection.touch(len(data))
+    return decode_message(data)
+
+
+async def send_resync(connection: Connection, app_id: int):
+    await connection.send({"type": "resync", "latest_seq": hub.latest_seq(app_id)})
+    async with async_read_session(connection.user) as db:
+        await connection.send(await get_recent_conversations_ws(db, app_id))
+
+
+async def handle_tagged_request(
+    connection: Connection, app_id: int, data: dict, request_id
+):
+    try:
+        result = await handle_request(connection, app_id, data)
     except Exception as e:
-        await websocket.send_text(f"Error: {str(e)}")
-        active_connections[app_id].remove(websocket)
-
-
-# Broadcast to all sockets in an app_id
-async def broadcast_to_app(app_id: int, message: dict):
-    websockets = active_connections.get(str(app_id), [])
-    for ws in websockets:
-        try:
-            await ws.send_json(message)
-        except:
-            pass  # Handle disconnects gracefully
+        result = {"error": str(e)}
+    if isinstance(result, str):
+        result = {"error": result}
+    await connection.send({**result, "id": request_id})
+
+
+async def handle_request(connection: Connection, app_id: int, data: dict):
+    type = data.get("type")
+
+    if type == "subscribe":
+        topics = hub.subscribe(connection, requested_topics(data))
+        return {"type": "subscribed", "topics": topics}
+
+    if type == "unsubscribe":
+        topics = hub.unsubscribe(connection, requested_topics(data))
+        return {"type": "unsubscribed", "topics": topics}
+
+    # Check a pooled DB connection out for this request only, so the
+    # number of open sockets is independent of the pool size. Reads go to a
+    # replica unless this socket's user wrote within the pinning window
+    if type in READ_REQUESTS:
+        session = async_read_session(connection.user)
+    else:
+        session = AsyncSessionLocal(info={"pin_key": connection.user})
+    async with session as db:
+        if type == "conversations":
+            return await get_recent_conversations_ws(db, app_id)
+
+        elif type == "get_contact":
+            wa_id = data.get("wa_id")
+            if not wa_id:
+                return {"error": "Missing wa_id"}
+            return await get_contact_by_by_id_ws(db, app_id, wa_id)
+
+        elif type == "get_messages":
+            wa_id = data.get("wa_id")
+            offset = data.get("offset") or 0         # Default to 0
+            limit = data.get("limit") or 30         # Default to 30
+
+            if not wa_id:
+                return {"error": "Missing wa_id"}
+            # Page with the cursors of the previous response (or before_id /
+            # after_id); offset is still accepted from older clients
+            return await get_messages_by_contact_ws(
+                db,
+                app_id,
+                wa_id,
+                offset=offset,
+                limit=limit,
+                cursor=data.get("cursor"),
+                before_id=data.get("before_id"),
+                after_id=data.get("after_id"),
+            )
+
+        elif type == "send_message":
+            to_number = data.get("to_number")
+            message_type = data.get("message_type")
+            payload = data.get("payload")
+            if not data:
+                return {"error": "Missing message payload"}
+
+            message_in = MessageCreate(
+                app_id=app_id,
+                to_number=to_number,
+                message_type=message_type,
+                payload=payload,
+            )
+
+            return await handle_send_message(db, message_in)
+
+    return f"Unsupported message type: {type}"
+
+
+def requested_topics(data: dict) -> list:
+    # {"topics": ["conversations", "contact:<wa_id>"]}, or the shorthands
+    # {"wa_id": "<wa_id>"} and {"topic": "conversations"}
+    topics = list(data.get("topics") or [])
+    if data.get("topic"):
+        topics.append(data["topic"])
+    if data.get("wa_id"):
+        topics.append(contact_topic(data["wa_id"]))
+    return [
+        topic
+        for topic in topics
+        if isinstance(topic, str)
+        and (topic == CONVERSATIONS_TOPIC or topic.startswith("contact:"))
+    ]
+
+
+# Broadcast to the sockets of an app_id, on every worker process. With a topic,
+# only sockets subscribed to it (or not using subscriptions) receive the event.
+# Each worker serializes once and queues per socket, never waiting on a client
+async def broadcast_to_app(app_id: int, message: dict, topic: str = None):
+    await broadcaster.publish(app_id, message, topic)
@@ -8,4 +8,84 @@ config = {
     "db_pass": "your_password",
     "secret_key": "secret", 
     "algorithm": "HS256",
+    # Connection pool per engine and worker (sync and async engines each get one);
+    # recycle below MySQL wait_timeout and pre-ping to avoid "gone away" errors
+    "db_pool_size": 5,
+    "db_max_overflow": 10,
+    "db_pool_timeout": 30,
+    "db_pool_recycle": 1800,
+    "db_pool_pre_ping": True,
+    # Checkouts waiting at least this many seconds are counted as slow
+    "db_pool_slow_wait": 0.1,
+    # Read replicas (same user, password and database as db_host). Read-only
+    # routes and WebSocket reads use replicas at most db_replica_max_lag seconds
+    # behind, else the primary; after a write, the same user (JWT sub, over
+    # HTTP or WebSocket) reads from the primary for db_read_your_writes_window
+    # seconds. Pins are kept per worker process, not shared between workers
+    "db_replica_hosts": [],
+    "db_replica_max_lag": 2.0,
+    "db_replica_check_interval": 5.0,
+    "db_read_your_writes_window": 5.0,
+    # Webhook ingestion: "sync" processes the delivery before replying,
+    # "queue" acks immediately and ingests from a durable on-disk queue
+    "webhook_ingest_mode": "sync",
+    "webhook_queue_path": "webhook_queue.db",
+    "webhook_queue_workers": 2,
+    "webhook_queue_batch_size": 100,
+    "webhook_queue_poll_interval": 1.0,
+    "webhook_queue_visibility_timeout": 60.0,
+    "webhook_queue_max_attempts": 5,
+    # Recently stored provider message ids kept in memory to reject retries
+    "webhook_dedupe_cache_size": 100000,
+    # Seconds to collect status callbacks before applying them in one UPDATE
+    "status_flush_interval": 1.0,
+    # Seconds a callback for a not-yet-stored message_id keeps being retried
+    "status_retry_window": 60.0,
+    # Parsed sender numbers kept in memory, keyed by wa_id
+    "phone_cache_size": 50000,
+    # Seconds before the in-memory app registry reloads the apps table
+    "app_registry_ttl": 60.0,
+    # Seconds an unknown app number/id is remembered before a miss reloads again
+    "app_registry_negative_ttl": 30.0,
+    # Seconds between batched writes of buffered Contact.last_active_at values
+    "activity_flush_interval": 5.0,
+    # Seconds a /contacts?include_total=true count is reused before recounting
+    "contacts_total_cache_ttl": 60.0,
+    # Per-socket send queue; when full, "drop_oldest", "drop_newest" or "disconnect"
+    "ws_send_queue_size": 256,
+    "ws_overflow_policy": "drop_oldest",
+    # Maximum topic subscriptions per socket
+    "ws_max_topics": 100,
+    # Requests tagged with an "id" handled concurrently per socket
+    "ws_max_inflight_requests": 8,
+    # Protocol-level pings sent by uvicorn (`python main.py`); a socket that
+    # doesn't answer within the timeout is closed
+    "ws_ping_interval": 20.0,
+    "ws_ping_timeout": 20.0,
+    # Hub sweep interval for dead sockets; clients connecting with ?heartbeat=1
+    # also get {"type": "ping"} after this much silence and are closed after
+    # ws_idle_timeout without any frame from them
+    "ws_heartbeat_interval": 20.0,
+    "ws_idle_timeout": 60.0,
+    # Open sockets allowed per app and per user (token sub); sockets without a
+    # token are only limited by the per-app cap
+    "ws_max_connections_per_app": 1000,
+    "ws_max_connections_per_user": 20,
+    # Recent broadcast events kept per app for clients reconnecting with resume_from
+    "ws_replay_buffer_size": 1000,
+    # permessage-deflate when started with `python main.py`: messages under
+    # ws_deflate_min_size bytes go out uncompressed; window bits (8-15) and
+    # mem level (1-9) trade compression ratio for per-socket memory
+    "ws_per_message_deflate": True,
+    "ws_deflate_min_size": 512,
+    "ws_deflate_level": 6,
+    "ws_deflate_max_window_bits": 12,
+    "ws_deflate_mem_level": 5,
+    # "local" reaches sockets of this process only; "redis" fans out across
+    # every uvicorn worker and node subscribed to the same channel
+    "broadcast_backend": "local",
+    "redis_url": "redis://localhost:6379/0",
+    "broadcast_channel": "chatbot:broadcast",
+    # Add X-Query-Count (SQL statements run by the request) to every response
+    "query_count_header": False,
 }
\ No newline at end of file
@@ -1,5 +1,519 @@
-from collections import defaultdict
-from starlette.websockets import WebSocket
+import asyncio
+import json
+import time
+from collections import defaultdict, deque
 
-# This ensures every key will have a default value of an empty set
-active_connections: dict[str, set[WebSocket]] = defaultdict(set)
+from starlette.websockets import WebSocket, WebSocketDisconnect, WebSocketState
+
+from config import config
+
+try:
+    import msgpack
+except ImportError:  # MessagePack framing is optional
+    msgpack = None
+
+# Wire encodings a client can negotiate; JSON text frames are the default
+ENCODINGS = ("json", "msgpack") if msgpack is not None else ("json",)
+
+# Per-app inbox summary (conversation.updated events)
+CONVERSATIONS_TOPIC = "conversations"
+
+
+def contact_topic(wa_id: str) -> str:
+    # A single conversation (message.created events for that contact)
+    return f"contact:{wa_id}"
+
+
+def encode_message(message, encoding: str = "json"):
+    # "json" gives text frames (str), "msgpack" binary frames (bytes)
+    if encoding == "msgpack" and msgpack is not None:
+        if isinstance(message, str):
+            message = {"type": "text", "text": message}
+        return msgpack.packb(message, use_bin_type=True)
+    if isinstance(message, str):
+        return message
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def decode_message(data):
+    # Clients may send JSON text frames or MessagePack binary frames
+    if isinstance(data, bytes):
+        if msgpack is None:
+            raise ValueError("MessagePack frames are not supported")
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+class Frame:
+    """
+    A message on its way to one or more sockets.
+
+    The payload is serialized lazily and at most once per wire encoding,
+    however many connections the frame is fanned out to.
+    """
+
+    __slots__ = ("message", "_encoded")
+
+    def __init__(self, message):
+        self.message = message
+        self._encoded = {}
+
+    def encode(self, encoding: str = "json"):
+        data = self._encoded.get(encoding)
+        if data is None:
+            data = self._encoded[encoding] = encode_message(self.message, encoding)
+        return data
+
+
+class Connection:
+    """
+    One WebSocket with its own bounded send queue and writer task.
+
+    Broadcasts are offered without waiting, so a slow client only ever delays
+    itself; what happens when its queue is full is decided by the hub policy.
+    Direct replies use `send`, which waits for queue space instead.
+    """
+
+    def __init__(
+        self,
+        hub: "ConnectionHub",
+        websocket: WebSocket,
+        app_id: int,
+        encoding: str = "json",
+        user: str = None,
+        heartbeat: bool = False,
+    ):
+        self.hub = hub
+        self.websocket = websocket
+        self.app_id = app_id
+        self.encoding = encoding
+        # Key of the per-user cap: the token sub, None for anonymous sockets
+        self.user = user
+        # Opted in to application-level pings (and idle reaping): the client
+        # answers {"type": "ping"} with {"type": "pong"}
+        self.heartbeat = heartbeat
+        self.queue = asyncio.Queue(maxsize=hub.max_queue)
+        self.closed = False
+        # None until the client subscribes: legacy sockets receive every event
+        self.topics = None
+
+        self.connected_at = time.monotonic()
+        # Last frame of any kind from the client, pongs included
+        self.last_seen = self.connected_at
+
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+        self._writer = asyncio.create_task(self._write())
+
+    def wants(self, topic: str) -> bool:
+        return topic is None or self.topics is None or topic in self.topics
+
+    @property
+    def alive(self) -> bool:
+        # False once the client is gone or the writer gave up on the socket
+        return (
+            not self.closed
+            and not self._writer.done()
+            and self.websocket.client_state == WebSocketState.CONNECTED
+            and self.websocket.application_state == WebSocketState.CONNECTED
+        )
+
+    def touch(self, size: int):
+        self.last_seen = time.monotonic()
+        self.received += 1
+        self.bytes_in += size
+        self.hub.traffic[self.app_id][0] += 1
+        self.hub.traffic[self.app_id][1] += size
+
+    async def send(self, message):
+        if not self.closed:
+            await self.queue.put(Frame(message))
+
+    def offer(self, frame: Frame):
+        if self.closed:
+            return
+        if self.queue.full():
+            if self.hub.overflow_policy == "disconnect":
+                self.hub.evicted += 1
+                self.hub.discard(self)
+                asyncio.create_task(self.close(code=1013))
+                return
+            self.dropped += 1
+            self.hub.dropped += 1
+            if self.hub.overflow_policy == "drop_newest":
+                return
+            # drop_oldest: make room by discarding the stalest queued frame
+            self.queue.get_nowait()
+            self.queue.task_done()
+        self.queue.put_nowait(frame)
+
+    async def _write(self):
+        try:
+            while True:
+                frame = await self.queue.get()
+                try:
+                    data = frame.encode(self.encoding)
+                except (TypeError, ValueError) as e:
+                    # An event that can't be serialized is skipped, not the socket
+                    self.queue.task_done()
+                    print(f"WebSocket frame for app {self.app_id} not sent: {e!r}")
+                    continue
+                if isinstance(data, bytes):
+                    await self.websocket.send_bytes(data)
+                else:
+                    await self.websocket.send_text(data)
+                self.queue.task_done()
+                self.sent += 1
+                self.bytes_out += len(data)
+                traffic = self.hub.traffic[self.app_id]
+                traffic[2] += 1
+                traffic[3] += len(data)
+        except asyncio.CancelledError:
+            raise
+        except WebSocketDisconnect:
+            # The client went away: stop fanning out to it
+            asyncio.create_task(self.hub.unregister(self))
+        except Exception as e:
+            print(f"WebSocket writer for app {self.app_id} failed, dropping it: {e!r}")
+            asyncio.create_task(self.hub.unregister(self))
+
+    async def close(self, code: int = None, drain: bool = False):
+        if self.closed:
+            return
+        self.closed = True
+        if drain and not self._writer.done():
+            # Give already queued replies a moment to go out
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+        if self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        if code is not None:
+            try:
+                await self.websocket.close(code=code)
+            except Exception:
+                pass
+
+
+class ConnectionHub:
+    """
+    Registry of live WebSocket connections per app_id, with a topic index.
+
+    Liveness is checked with protocol-level pings, which uvicorn sends
+    (`ws_ping_interval` / `ws_ping_timeout`) and browsers answer on their own;
+    a socket that fails them is closed by the server and unregistered. The
+    hub's heartbeat task only reaps sockets whose transport is gone, plus,
+    for clients that opted in with ?heartbeat=1, pings them at the
+    application level and evicts those silent past the idle timeout.
+    Connections are capped per app and per user, and frames/bytes in and out
+    are counted per app.
+
+    `publish` serializes a broadcast once and pushes it into the bounded queue
+    of every interested connection without awaiting any socket. An event with
+    a topic goes to the sockets subscribed to that topic, plus sockets that
+    never subscribed to anything (clients predating topics, which keep getting
+    every event of their app). When a queue is full the
+    overflow policy applies: "drop_oldest" (default) or "drop_newest" drop a
+    frame for that client, "disconnect" evicts the slow consumer.
+    """
+
+    def __init__(
+        self,
+        max_queue: int = 256,
+        overflow_policy: str = "drop_oldest",
+        max_topics: int = 100,
+        replay_size: int = 1000,
+        heartbeat_interval: float = 20.0,
+        idle_timeout: float = 60.0,
+        max_per_app: int = None,
+        max_per_user: int = None,
+    ):
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.max_topics = max_topics
+        self.replay_size = replay_size
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.max_per_app = max_per_app
+        self.max_per_user = max_per_user
+        self._heartbeat = None
+        self.history: dict[int, deque] = {}
+        self._seq: dict[int, int] = {}
+        self.connections: dict[int, set[Connection]] = defaultdict(set)
+        self.unsubscribed: dict[int, set[Connection]] = defaultdict(set)
+        self.subscribers: dict[tuple, set[Connection]] = defaultdict(set)
+        self.users: dict[str, set[Connection]] = defaultdict(set)
+        # Per app: [frames_in, bytes_in, frames_out, bytes_out], cumulative,
+        # and the per-second rates over the last heartbeat interval
+        self.traffic: dict[int, list] = defaultdict(lambda: [0, 0, 0, 0])
+        self.rates: dict[int, dict] = {}
+        self._traffic_mark = ({}, time.monotonic())
+
+        self.accepted = 0
+        self.rejected = 0
+        self.reaped = 0
+        self.published = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.evicted = 0
+
+    def admit(self, app_id: int, user: str = None):
+        # Reason the socket can't be accepted, or None if it's within the caps.
+        # Only identified users have a per-user cap; anonymous sockets (user
+        # None) count against the per-app cap alone
+        reason = None
+        connections = self.connections.get(app_id, ())
+        if self.max_per_app and len(connections) >= self.max_per_app:
+            reason = "Too many connections for this app"
+        elif (
+            user is not None
+            and self.max_per_user
+            and len(self.users.get(user, ())) >= self.max_per_user
+        ):
+            reason = "Too many connections for this user"
+        if reason:
+            self.rejected += 1
+        return reason
+
+    def register(
+        self,
+        websocket: WebSocket,
+        app_id: int,
+        encoding: str = "json",
+        user: str = None,
+        heartbeat: bool = False,
+    ) -> Connection:
+        connection = Connection(self, websocket, app_id, encoding, user, heartbeat)
+        self.connections[app_id].add(connection)
+        self.unsubscribed[app_id].add(connection)
+        if user is not None:
+            self.users[user].add(connection)
+        self.accepted += 1
+        return connection
+
+    def discard(self, connection: Connection):
+        app_id = connection.app_id
+        self._remove(self.connections, app_id, connection)
+        self._remove(self.unsubscribed, app_id, connection)
+        if connection.user is not None:
+            self._remove(self.users, connection.user, connection)
+        for topic in connection.topics or ():
+            self._remove(self.subscribers, (app_id, topic), connection)
+
+    def _remove(self, index: dict, key, connection: Connection):
+        sockets = index.get(key)
+        if sockets is not None:
+            sockets.discard(connection)
+            if not sockets:
+                del index[key]
+
+    def subscribe(self, connection: Connection, topics: list) -> list:
+        if connection.topics is None:
+            connection.topics = set()
+            self._remove(self.unsubscribed, connection.app_id, connection)
+        for topic in topics:
+            if len(connection.topics) >= self.max_topics:
+                break
+            connection.topics.add(topic)
+            self.subscribers[(connection.app_id, topic)].add(connection)
+        return sorted(connection.topics)
+
+    def unsubscribe(self, connection: Connection, topics: list) -> list:
+        if connection.topics is None:
+            return []
+        for topic in topics:
+            connection.topics.discard(topic)
+            self._remove(self.subscribers, (connection.app_id, topic), connection)
+        return sorted(connection.topics)
+
+    async def unregister(
+        self, connection: Connection, close_code: int = None, drain: bool = False
+    ):
+        self.discard(connection)
+        await connection.close(close_code, drain=drain)
+
+    def next_seq(self, app_id: int) -> int:
+        # Follows the newest seq seen (also those stamped by Redis, for events
+        # stamped here while the broker is down); otherwise seeded from the
+        # clock so numbers keep growing across restarts and a client resuming
+        # from a previous process always falls back to a resync
+        seq = (
+            max(self._seq.get(app_id, 0), self.latest_seq(app_id) or 0)
+            or time.time_ns() // 1000
+        )
+        self._seq[app_id] = seq + 1
+        return seq + 1
+
+    def publish(self, app_id: int, message, topic: str = None) -> int:
+        app_id = int(app_id)
+        frame = Frame(message)
+        seq = message.get("seq") if isinstance(message, dict) else None
+        if seq is not None:
+            history = self.history.get(app_id)
+            if history is None:
+                history = self.history[app_id] = deque(maxlen=self.replay_size)
+            history.append((seq, topic, frame))
+
+        if topic is None:
+            connections = self.connections.get(app_id, set())
+        else:
+            connections = self.unsubscribed.get(app_id, set())
+            subscribed = self.subscribers.get((app_id, topic))
+            if subscribed:
+                connections = connections | subscribed
+        if not connections:
+            return 0
+        for connection in list(connections):
+            connection.offer(frame)
+        self.published += 1
+        return len(connections)
+
+    def latest_seq(self, app_id: int):
+        history = self.history.get(int(app_id))
+        return history[-1][0] if history else None
+
+    def resume(self, connection: Connection, resume_from: int) -> bool:
+        """
+        Queue the events of the connection's app published after `resume_from`.
+
+        Returns False when the gap cannot be filled from the replay buffer (too
+        old, unknown, or more than the send queue holds); the caller should
+        then send a full snapshot instead. Must be called right after
+        `register`, without awaiting in between, so no live event slips
+        between the replay and the live stream.
+        """
+        history = self.history.get(connection.app_id)
+        if not history:
+            return False
+        if resume_from == history[-1][0]:
+            return True
+        if resume_from > history[-1][0] or resume_from < history[0][0] - 1:
+            return False
+
+        missed = [
+            frame
+            for seq, topic, frame in history
+            if seq > resume_from and connection.wants(topic)
+        ]
+        if len(missed) > self.max_queue:
+            return False
+        for frame in missed:
+            connection.offer(frame)
+        self.replayed += len(missed)
+        return True
+
+    def start(self):
+        if self.heartbeat_interval:
+            self._heartbeat = asyncio.create_task(self._run_heartbeat())
+
+    async def stop(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+        for connections in list(self.connections.values()):
+            for connection in list(connections):
+                await self.unregister(connection, close_code=1001)
+
+    async def _run_heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(f"WebSocket heartbeat failed: {e}")
+
+    def heartbeat(self):
+        now = time.monotonic()
+        ping = Frame({"type": "ping", "ts": int(time.time() * 1000)})
+        for connections in list(self.connections.values()):
+            for connection in list(connections):
+                quiet = now - connection.last_seen
+                # Passive clients never reply to app-level pings: only sockets
+                # that opted in are judged on silence, the rest on transport
+                if not connection.alive or (
+                    connection.heartbeat and quiet >= self.idle_timeout
+                ):
+                    # Dead or unresponsive: drop it from fan-out right away
+                    self.reaped += 1
+                    self.discard(connection)
+                    asyncio.create_task(connection.close(code=1001))
+                elif connection.heartbeat and quiet >= self.heartbeat_interval:
+                    connection.offer(ping)
+        self._update_rates(now)
+
+    def _update_rates(self, now: float):
+        previous, since = self._traffic_mark
+        elapsed = max(now - since, 1e-6)
+        rates = {}
+        for app_id, totals in self.traffic.items():
+            before = previous.get(app_id, (0, 0, 0, 0))
+            rates[app_id] = {
+                "frames_in_per_sec": round((totals[0] - before[0]) / elapsed, 2),
+                "bytes_in_per_sec": round((totals[1] - before[1]) / elapsed, 2),
+                "frames_out_per_sec": round((totals[2] - before[2]) / elapsed, 2),
+                "bytes_out_per_sec": round((totals[3] - before[3]) / elapsed, 2),
+            }
+        self.rates = rates
+        self._traffic_mark = (
+            {app_id: tuple(totals) for app_id, totals in self.traffic.items()},
+            now,
+        )
+
+    def stats(self) -> dict:
+        apps = {}
+        for app_id in set(self.connections) | set(self.traffic):
+            connections = self.connections.get(app_id, ())
+            frames_in, bytes_in, frames_out, bytes_out = self.traffic.get(
+                app_id, (0, 0, 0, 0)
+            )
+            apps[app_id] = {
+                "connections": len(connections),
+                "unsubscribed": len(self.unsubscribed.get(app_id, ())),
+                "queued": sum(c.queue.qsize() for c in connections),
+                "max_queued": max((c.queue.qsize() for c in connections), default=0),
+                "dropped": sum(c.dropped for c in connections),
+                "replay_buffer": len(self.history.get(app_id, ())),
+                "frames_in": frames_in,
+                "bytes_in": bytes_in,
+                "frames_out": frames_out,
+                "bytes_out": bytes_out,
+                **self.rates.get(app_id, {}),
+            }
+        return {
+            "connections": sum(len(c) for c in self.connections.values()),
+            "users": len(self.users),
+            "topics": len(self.subscribers),
+            "max_queue": self.max_queue,
+            "overflow_policy": self.overflow_policy,
+            "heartbeat_interval": self.heartbeat_interval,
+            "idle_timeout": self.idle_timeout,
+            "max_per_app": self.max_per_app,
+            "max_per_user": self.max_per_user,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "reaped": self.reaped,
+            "published": self.published,
+            "replayed": self.replayed,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "apps": apps,
+        }
+
+
+# Live WebSocket connections of this process, grouped by app_id
+hub = ConnectionHub(
+    max_queue=config.get("ws_send_queue_size", 256),
+    overflow_policy=config.get("ws_overflow_policy", "drop_oldest"),
+    max_topics=config.get("ws_max_topics", 100),
+    replay_size=config.get("ws_replay_buffer_size", 1000),
+    heartbeat_interval=config.get("ws_heartbeat_interval", 20.0),
+    idle_timeout=config.get("ws_idle_timeout", 60.0),
+    max_per_app=config.get("ws_max_connections_per_app", 1000),
+    max_per_user=config.get("ws_max_connections_per_user", 20),
+)
@@ -1,28 +1,467 @@
-from sqlalchemy import create_engine
+import asyncio
+import itertools
+import threading
+import time
+
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from config import config
 
-DATABASE_URL = (
-    "mysql+pymysql://"
-    + config["db_user"]
-    + ":"
-    + config["db_pass"]
-    + "@"
-    + config["db_host"]
-    + "/"
-    + config["db_name"]
+
+def database_url(driver: str, host: str) -> str:
+    return (
+        driver
+        + "://"
+        + config["db_user"]
+        + ":"
+        + config["db_pass"]
+        + "@"
+        + host
+        + "/"
+        + config["db_name"]
+    )
+
+
+DATABASE_URL = database_url("mysql+pymysql", config["db_host"])
+ASYNC_DATABASE_URL = database_url("mysql+aiomysql", config["db_host"])
+
+
+class PoolMetrics:
+    """
+    Counters for one connection pool of this worker.
+
+    Checkout wait is the time spent obtaining a connection from the pool
+    (including opening a new one for overflow); the other counters come
+    from pool events.
+    """
+
+    def __init__(self, slow_wait: float = 0.1):
+        self.slow_wait = slow_wait
+        self._lock = threading.Lock()
+
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.max_checked_out = 0
+        self.waits = 0
+        self.slow_waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.waits += 1
+            self.wait_total += seconds
+            if seconds > self.wait_max:
+                self.wait_max = seconds
+            if seconds >= self.slow_wait:
+                self.slow_waits += 1
+
+    def record_checkout(self, checked_out: int):
+        with self._lock:
+            self.checkouts += 1
+            if checked_out > self.max_checked_out:
+                self.max_checked_out = checked_out
+
+    def stats(self) -> dict:
+        return {
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "checkins": self.checkins,
+            "invalidations": self.invalidations,
+            "timeouts": self.timeouts,
+            "max_checked_out": self.max_checked_out,
+            "slow_waits": self.slow_waits,
+            "wait_avg_ms": round(self.wait_total / self.waits * 1000, 3)
+            if self.waits
+            else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+        }
+
+
+class InstrumentedPoolMixin:
+    # Times every checkout; the metrics object survives pool recreation (dispose)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics(config.get("db_pool_slow_wait", 0.1))
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except sa_exc.TimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        finally:
+            self.metrics.record_wait(time.perf_counter() - start)
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def instrument_pool_events(engine):
+    # `engine` is a sync Engine (an AsyncEngine's is `.sync_engine`)
+    def metrics():
+        return engine.pool.metrics
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        metrics().connects += 1
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics().record_checkout(engine.pool.checkedout())
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        metrics().checkins += 1
+
+    # Connections dropped as stale (pre-ping, "gone away") or broken
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        metrics().invalidations += 1
+
+    @event.listens_for(engine, "soft_invalidate")
+    def on_soft_invalidate(dbapi_connection, connection_record, exception):
+        metrics().invalidations += 1
+
+
+# Per-worker pool sizing; pre-ping and recycle keep idle connections from
+# hitting MySQL "server has gone away" after wait_timeout
+POOL_OPTIONS = {
+    "pool_size": config.get("db_pool_size", 5),
+    "max_overflow": config.get("db_max_overflow", 10),
+    "pool_timeout": config.get("db_pool_timeout", 30),
+    "pool_recycle": config.get("db_pool_recycle", 1800),
+    "pool_pre_ping": config.get("db_pool_pre_ping", True),
+}
+
+
+def create_engines(host: str):
+    # A blocking and an async engine for one MySQL server, both instrumented
+    sync_engine = create_engine(
+        database_url("mysql+pymysql", host),
+        poolclass=InstrumentedQueuePool,
+        **POOL_OPTIONS,
+    )
+    instrument_pool_events(sync_engine)
+    async_engine = create_async_engine(
+        database_url("mysql+aiomysql", host),
+        poolclass=InstrumentedAsyncQueuePool,
+        **POOL_OPTIONS,
+    )
+    instrument_pool_events(async_engine.sync_engine)
+    return sync_engine, async_engine
+
+
+# Blocking engine: alembic, sync routes (run in the threadpool) and the
+# background flushers that already run in worker threads.
+# Non-blocking engine for code running on the event loop (WebSocket handlers,
+# webhook ingestion).
+engine, async_engine = create_engines(config["db_host"])
+
+
+# Replication status statement and its lag column, newest syntax first: SHOW
+# REPLICA STATUS needs MySQL 8.0.22+, older servers only know SHOW SLAVE STATUS
+REPLICA_STATUS = (
+    ("SHOW REPLICA STATUS", "Seconds_Behind_Source"),
+    ("SHOW SLAVE STATUS", "Seconds_Behind_Master"),
 )
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=True)
+
+class Replica:
+    def __init__(self, host: str):
+        self.host = host
+        self.engine, self.async_engine = create_engines(host)
+        # Seconds behind the primary; None until checked or when unknown
+        self.lag = None
+        self.reads = 0
+        self.errors = 0
+        # Index in REPLICA_STATUS of the syntax this server understands
+        self._status = 0
+
+    async def check_lag(self):
+        try:
+            async with self.async_engine.connect() as conn:
+                row, column = await self._replica_status(conn)
+        except Exception as e:
+            self.errors += 1
+            self.lag = None
+            print(f"Replica {self.host} lag check failed: {e}")
+            return
+        if row is None:
+            # Not a binlog replica (e.g. a managed read endpoint): assume in sync
+            self.lag = 0
+        else:
+            # NULL while replication is stopped or broken
+            self.lag = row.get(column)
+
+    async def _replica_status(self, conn):
+        while True:
+            statement, column = REPLICA_STATUS[self._status]
+            try:
+                result = await conn.exec_driver_sql(statement)
+            except sa_exc.ProgrammingError:
+                # Syntax error on an older server: fall back for good
+                if self._status + 1 == len(REPLICA_STATUS):
+                    raise
+                self._status += 1
+                continue
+            return result.mappings().first(), column
+
+
+class ReadRouter:
+    """
+    Picks the engine for read-only sessions.
+
+    Replicas are polled for their lag every `check_interval` seconds and
+    only those at most `max_lag` seconds behind serve reads (round-robin);
+    with none available reads fall back to the primary. After a write, the
+    writer's pin key (see `dependency.token_pin_key`, the same over HTTP and
+    WebSocket) reads from the primary for `pin_window` seconds so it sees its
+    own writes.
+
+    Pins live in the memory of each worker process: with several workers, a
+    read that lands on another worker than the write isn't pinned and may
+    still be served by a replica within `max_lag`.
+    """
+
+    def __init__(
+        self,
+        hosts: list,
+        max_lag: float = 2.0,
+        check_interval: float = 5.0,
+        pin_window: float = 5.0,
+    ):
+        self.replicas = [Replica(host) for host in hosts]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.pin_window = pin_window
+        self._writes = {}
+        self._next = itertools.count()
+        self._task = None
+
+        self.primary_reads = 0
+        self.pinned_reads = 0
+        self.lag_fallbacks = 0
+
+    def mark_write(self, pin_key: str):
+        if pin_key is None or not self.replicas:
+            return
+        now = time.monotonic()
+        if len(self._writes) > 10000:
+            self._writes = {
+                key: at
+                for key, at in self._writes.items()
+                if now - at < self.pin_window
+            }
+        self._writes[pin_key] = now
+
+    def read_engine(self, pin_key: str, use_async: bool):
+        # Engine for a read-only session; None means the primary
+        if not self.replicas:
+            self.primary_reads += 1
+            return None
+        written = self._writes.get(pin_key) if pin_key is not None else None
+        if written is not None and time.monotonic() - written < self.pin_window:
+            self.pinned_reads += 1
+            return None
+        fresh = [
+            replica
+            for replica in self.replicas
+            if replica.lag is not None and replica.lag <= self.max_lag
+        ]
+        if not fresh:
+            self.lag_fallbacks += 1
+            return None
+        replica = fresh[next(self._next) % len(fresh)]
+        replica.reads += 1
+        return replica.async_engine.sync_engine if use_async else replica.engine
+
+    async def check(self):
+        await asyncio.gather(*(replica.check_lag() for replica in self.replicas))
+
+    async def start(self):
+        if self.replicas:
+            await self.check()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for replica in self.replicas:
+            await replica.async_engine.dispose()
+            replica.engine.dispose()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check()
+
+    def stats(self) -> dict:
+        return {
+            "replicas": [
+                {
+                    "host": replica.host,
+                    "lag": replica.lag,
+                    "reads": replica.reads,
+                    "errors": replica.errors,
+                    "sync_pool": _pool_stats(replica.engine.pool),
+                    "async_pool": _pool_stats(replica.async_engine.pool),
+                }
+                for replica in self.replicas
+            ],
+            "max_lag": self.max_lag,
+            "primary_reads": self.primary_reads,
+            "pinned_reads": self.pinned_reads,
+            "lag_fallbacks": self.lag_fallbacks,
+        }
+
+
+read_router = ReadRouter(
+    config.get("db_replica_hosts", []),
+    max_lag=config.get("db_replica_max_lag", 2.0),
+    check_interval=config.get("db_replica_check_interval", 5.0),
+    pin_window=config.get("db_read_your_writes_window", 5.0),
+)
+
+
+class RoutingSession(Session):
+    """
+    Session that sends reads to a replica when opened as read-only.
+
+    Sessions are read-write unless created with info={"read_only": True}.
+    A read-only session picks its engine once, on first use, and switches to
+    the primary for good as soon as it writes; a write from any session also
+    pins its info["pin_key"] to the primary for the read-your-writes window.
+    """
+
+    use_async = False
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        primary = async_engine.sync_engine if self.use_async else engine
+        info = self.info
+        if not info.get("read_only") or info.get("wrote") or self._flushing:
+            return primary
+        if "engine" not in info:
+            info["engine"] = read_router.read_engine(
+                info.get("pin_key"), self.use_async
+            )
+        return info["engine"] or primary
+
+
+class AsyncRoutingSession(RoutingSession):
+    # Sync session class behind AsyncSession: binds to the async engines
+    use_async = True
+
+
+def _mark_write(session: Session):
+    session.info["wrote"] = True
+    read_router.mark_write(session.info.get("pin_key"))
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def on_orm_execute(orm_execute_state):
+    if (
+        orm_execute_state.is_insert
+        or orm_execute_state.is_update
+        or orm_execute_state.is_delete
+    ):
+        _mark_write(orm_execute_state.session)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def on_after_flush(session, flush_context):
+    _mark_write(session)
+
+
+SessionLocal = sessionmaker(
+    bind=engine, class_=RoutingSession, autocommit=False, autoflush=True
+)
+
+# expire_on_commit=False keeps loaded objects readable after commit, since an
+# AsyncSession can't lazily reload them
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    sync_session_class=AsyncRoutingSession,
+    autoflush=True,
+    expire_on_commit=False,
+)
+
+
+def read_session(pin_key: str = None) -> Session:
+    return SessionLocal(info={"read_only": True, "pin_key": pin_key})
+
+
+def async_read_session(pin_key: str = None):
+    return AsyncSessionLocal(info={"read_only": True, "pin_key": pin_key})
+
+
+def request_pin_key(request: Request):
+    # Set by dependency.pin_key_middleware from the caller's token
+    return getattr(request.state, "pin_key", None)
+
 
 Base = declarative_base()
 
+
+def pool_status():
+    # Pool utilisation of this worker, to compare against live socket counts
+    return {
+        "sync": _pool_stats(engine.pool),
+        "async": _pool_stats(async_engine.pool),
+        "read_routing": read_router.stats(),
+    }
+
+
+def _pool_stats(pool):
+    return {
+        "size": pool.size(),
+        "max_overflow": pool._max_overflow,
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        **pool.metrics.stats(),
+    }
+
 # Dependency for FastAPI routes
-def get_db():
-    db = SessionLocal()
+def get_db(request: Request):
+    db = SessionLocal(info={"pin_key": request_pin_key(request)})
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# Dependency for read-only routes: may be served by a replica
+def get_read_db(request: Request):
+    db = read_session(request_pin_key(request))
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# Dependency for async routes: queries are awaited instead of blocking the loop
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
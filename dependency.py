@@ -1,9 +1,9 @@
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
 from models import User
-from database import SessionLocal
+from database import SessionLocal, get_read_db
 
 # Dependency
 def get_db():
@@ -20,7 +20,7 @@ ALGORITHM = "HS256"
 
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     token = credentials.credentials
     try:
@@ -32,6 +32,29 @@ def get_current_user(
         raise HTTPException(status_code=401, detail="Token decode error")
 
     user = db.query(User).filter(User.email == email).first()
+    if not user:
+        # A user who just signed up may not have reached the replica yet
+        with SessionLocal() as primary:
+            user = primary.query(User).filter(User.email == email).first()
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
     return user
+
+
+def token_pin_key(token: str):
+    # Read-your-writes key of a JWT: its subject, so one user's HTTP requests
+    # and WebSocket sockets pin each other, whichever token they carry
+    try:
+        sub = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+    return f"user:{sub}" if sub else None
+
+
+async def pin_key_middleware(request: Request, call_next):
+    # Pin key of the caller's bearer token, read by the session dependencies
+    # of database.py so the data layer doesn't decode tokens itself
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        request.state.pin_key = token_pin_key(token)
+    return await call_next(request)
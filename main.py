@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.auth import router as auth_route
@@ -7,11 +8,42 @@ from app.api.contact import router as contact_route
 from app.api.message import router as message_route
 from app.api.webhook import router as webhook_route
 from app.api.template import router as template_route
+from app.api.webhook import process_webhook_batch
+from app.api.metrics import router as metrics_route
+from app.services.webhook_queue import webhook_queue
+from app.services.status_buffer import status_buffer
+from app.services.activity_buffer import activity_buffer
+from app.services.broadcast import broadcaster
 from app.websocket import router as websocket
-from dependency import get_current_user
+from connection_pool import hub
+from dependency import get_current_user, pin_key_middleware
 from fastapi.staticfiles import StaticFiles
+from config import config
+from database import async_engine, read_router
+from query_count import query_count_middleware
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await broadcaster.start()
+    await read_router.start()
+    hub.start()
+    # Start the webhook queue workers; pending bodies from a previous run are replayed
+    if config.get("webhook_ingest_mode", "sync") == "queue":
+        webhook_queue.start(process_webhook_batch)
+    status_buffer.start()
+    activity_buffer.start()
+    yield
+    await hub.stop()
+    await webhook_queue.stop()
+    await status_buffer.stop()
+    await activity_buffer.stop()
+    await broadcaster.stop()
+    await read_router.stop()
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = ["*"]
 
@@ -21,8 +53,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Pagination cursors and totals of GET /messages/{contact_number} and /contacts
+    expose_headers=["X-Prev-Cursor", "X-Next-Cursor", "X-Total-Count"],
 )
 
+# Read-your-writes pin key of the caller, for the session dependencies
+app.middleware("http")(pin_key_middleware)
+
+# X-Query-Count on every response (tests and query-count debugging)
+if config.get("query_count_header", False):
+    app.middleware("http")(query_count_middleware)
+
 # Serve the ./uploads folder at /uploads URL
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
@@ -34,3 +75,22 @@ app.include_router(message_route, dependencies=[Depends(get_current_user)])
 app.include_router(webhook_route)
 app.include_router(template_route)
 app.include_router(websocket)
+app.include_router(metrics_route, dependencies=[Depends(get_current_user)])
+
+
+if __name__ == "__main__":
+    import uvicorn
+    from ws_protocol import DeflateWebSocketProtocol
+
+    # `python main.py` serves WebSockets with the tuned permessage-deflate
+    # (the uvicorn CLI can only switch the extension on or off)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        ws=DeflateWebSocketProtocol,
+        ws_per_message_deflate=config.get("ws_per_message_deflate", True),
+        # Protocol-level keepalive, answered by browsers without client code
+        ws_ping_interval=config.get("ws_ping_interval", 20.0),
+        ws_ping_timeout=config.get("ws_ping_timeout", 20.0),
+    )
@@ -11,6 +11,8 @@ from sqlalchemy import (
     BigInteger,
     Double,
     JSON,
+    UniqueConstraint,
+    Index,
 )
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -22,6 +24,8 @@ contact_tags = Table(
     Base.metadata,
     Column("contact_id", Integer, ForeignKey("contacts.id"), primary_key=True),
     Column("tag_id", Integer, ForeignKey("tags.id"), primary_key=True),
+    # Contacts with a given tag (the primary key only serves contact -> tags)
+    Index("ix_contact_tags_tag_id_contact_id", "tag_id", "contact_id"),
 )
 
 
@@ -43,7 +47,7 @@ class App(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     business_name = Column(String(255), nullable=False)
-    whatsapp_number = Column(String(255), nullable=False)
+    whatsapp_number = Column(String(255), nullable=False, index=True)
     is_active = Column(Boolean, default=False, nullable=False)
     is_whatsapp_verified = Column(Boolean, default=False, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -67,6 +71,15 @@ class Tag(Base):
 
 class Contact(Base):
     __tablename__ = "contacts"
+    __table_args__ = (
+        UniqueConstraint("app_id", "wa_id", name="uq_contacts_app_id_wa_id"),
+        # Filters of GET /contacts; each index also carries id for keyset pages
+        Index("ix_contacts_app_id_opted_in", "app_id", "opted_in"),
+        Index("ix_contacts_app_id_is_active", "app_id", "is_active"),
+        Index("ix_contacts_app_id_source", "app_id", "source"),
+        Index("ix_contacts_app_id_last_active_at", "app_id", "last_active_at"),
+        Index("ix_contacts_app_id_name", "app_id", "name"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     app_id = Column(Integer, ForeignKey("apps.id"), nullable=False, index=True)
@@ -92,13 +105,18 @@ class Contact(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    # Keyset history pages of one conversation (see app/crud/message.py)
+    __table_args__ = (
+        Index("ix_messages_app_id_contact_id_id", "app_id", "contact_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     app_id = Column(Integer, ForeignKey("apps.id"), nullable=False)
     contact_id = Column(Integer, ForeignKey("contacts.id"), nullable=False)
 
     # WhatsApp-specific fields
-    # message_id = Column(String(100), nullable=False, unique=True)
+    # Provider message id; outbound messages only get one once the provider accepts them
+    message_id = Column(String(100), nullable=True, unique=True, index=True)
     from_number = Column(String(20), nullable=False)
     to_number = Column(String(20), nullable=False)
 
@@ -135,3 +153,29 @@ class Message(Base):
     read_at = Column(DateTime, nullable=True)
 
     created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class Conversation(Base):
+    # Inbox summary, one row per (app, contact), kept up to date in the same
+    # transaction as message inserts and status changes (app/crud/conversations.py)
+    __tablename__ = "conversations"
+    __table_args__ = (
+        UniqueConstraint(
+            "app_id", "contact_id", name="uq_conversations_app_id_contact_id"
+        ),
+        Index("ix_conversations_app_id_last_sent_at", "app_id", "last_sent_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    app_id = Column(Integer, ForeignKey("apps.id"), nullable=False)
+    contact_id = Column(Integer, ForeignKey("contacts.id"), nullable=False)
+
+    last_message_id = Column(Integer, ForeignKey("messages.id"), nullable=True)
+    last_message_type = Column(String(20), nullable=True)
+    last_message_preview = Column(String(255), nullable=True)
+    last_message_status = Column(String(20), nullable=True)
+    last_sent_at = Column(DateTime, nullable=True)
+    # Inbound messages not yet marked read
+    unread_count = Column(Integer, nullable=False, default=0, server_default="0")
+
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,61 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Counter of the request (or block) being measured; None when nothing is counting
+_current = ContextVar("query_counter", default=None)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    # Every engine (primary, replicas, the async engines' sync side) reports here
+    counter = _current.get()
+    if counter is not None:
+        counter.count += 1
+        counter.statements.append(statement)
+
+
+@contextmanager
+def count_queries():
+    """
+    Count the SQL statements executed inside the block.
+
+    The counter lives in a context variable, so it follows the request into
+    the threadpool of sync routes and into tasks it starts, and concurrent
+    requests don't see each other's queries.
+    """
+    counter = QueryCounter()
+    token = _current.set(counter)
+    try:
+        yield counter
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def assert_query_count(expected: int):
+    # Fails the block unless it ran exactly `expected` statements, listing them
+    with count_queries() as counter:
+        yield counter
+    if counter.count != expected:
+        statements = "\n".join(counter.statements)
+        raise AssertionError(
+            f"Expected {expected} queries, got {counter.count}:\n{statements}"
+        )
+
+
+async def query_count_middleware(request, call_next):
+    # Reports the statements a request ran in X-Query-Count, so a list
+    # endpoint can be pinned to a constant number of queries over HTTP
+    with count_queries() as counter:
+        response = await call_next(request)
+    response.headers["X-Query-Count"] = str(counter.count)
+    return response
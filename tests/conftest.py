@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+import models
+from main import app
+from database import get_db, get_read_db
+from dependency import get_current_user
+from app.services.app_registry import AppSnapshot, app_registry
+
+
+@pytest.fixture
+def db_engine():
+    # One in-memory SQLite database shared by the test and the app's threads
+    engine = create_engine(
+        "sqlite://",
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False},
+    )
+    models.Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def user():
+    return SimpleNamespace(id=1, email="owner@example.com")
+
+
+@pytest.fixture
+def apps(user):
+    # App 1 belongs to `user`, app 2 to somebody else
+    return {
+        1: AppSnapshot(1, user.id, "Test app", "15550001", True, True),
+        2: AppSnapshot(2, user.id + 1, "Other app", "15550002", True, True),
+    }
+
+
+@pytest.fixture
+def client(db_engine, user, apps, monkeypatch):
+    """
+    TestClient on the SQLite database, signed in as `user`, who owns app 1.
+
+    The app registry is served from `apps` in memory so it adds no queries.
+    """
+
+    def session():
+        with Session(db_engine) as db:
+            yield db
+
+    monkeypatch.setattr(app_registry, "get_by_id", lambda app_id: apps.get(int(app_id)))
+    app.dependency_overrides[get_db] = session
+    app.dependency_overrides[get_read_db] = session
+    app.dependency_overrides[get_current_user] = lambda: user
+    yield TestClient(app)
+    app.dependency_overrides.clear()
@@ -0,0 +1,24 @@
+import asyncio
+
+from connection_pool import ConnectionHub
+from app.services.broadcast import RedisBroadcast
+
+
+def test_redis_fallback_events_enter_the_replay_buffer(monkeypatch):
+    hub = ConnectionHub()
+    monkeypatch.setattr("app.services.broadcast.hub", hub)
+    broadcast = RedisBroadcast("redis://localhost:6379/0", "test")
+
+    async def unreachable(keys, args):
+        raise ConnectionError("broker down")
+
+    broadcast._publish = unreachable
+    # Last event numbered by Redis before the broker went away
+    hub.publish(1, {"type": "message.created", "seq": 41})
+    asyncio.run(broadcast.publish(1, {"type": "message.created"}, "contact:91"))
+
+    assert broadcast.errors == 1
+    assert [(seq, topic) for seq, topic, _ in hub.history[1]] == [
+        (41, None),
+        (42, "contact:91"),
+    ]
@@ -0,0 +1,211 @@
+import asyncio
+import json
+
+import pytest
+from starlette.websockets import WebSocketDisconnect, WebSocketState
+
+from connection_pool import ConnectionHub
+
+
+class FakeWebSocket:
+    # Records what the writer sends; `block` holds sends back, `error` fails them
+    def __init__(self, error: Exception = None):
+        self.client_state = WebSocketState.CONNECTED
+        self.application_state = WebSocketState.CONNECTED
+        self.sent = []
+        self.error = error
+        self.block = None
+        self.close_code = None
+
+    async def send_text(self, data):
+        if self.block is not None:
+            await self.block.wait()
+        if self.error is not None:
+            raise self.error
+        self.sent.append(json.loads(data))
+
+    async def close(self, code=None):
+        self.close_code = code
+        self.application_state = WebSocketState.DISCONNECTED
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def settle():
+    # Let the writer tasks drain their queues
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def connect(hub, app_id=1, user=None, topics=None, websocket=None):
+    connection = hub.register(websocket or FakeWebSocket(), app_id, user=user)
+    if topics is not None:
+        hub.subscribe(connection, topics)
+    return connection
+
+
+def received(connection) -> list:
+    return [event["n"] for event in connection.websocket.sent]
+
+
+def test_topics_route_events():
+    async def main():
+        hub = ConnectionHub()
+        legacy = connect(hub)
+        inbox = connect(hub, topics=["conversations"])
+        chat = connect(hub, topics=["contact:91"])
+        other_app = connect(hub, app_id=2)
+
+        hub.publish(1, {"n": 1}, "conversations")
+        hub.publish(1, {"n": 2}, "contact:91")
+        hub.publish(1, {"n": 3})
+        await settle()
+        return legacy, inbox, chat, other_app
+
+    legacy, inbox, chat, other_app = run(main())
+    # Sockets that never subscribed get everything of their app
+    assert received(legacy) == [1, 2, 3]
+    assert received(inbox) == [1, 3]
+    assert received(chat) == [2, 3]
+    assert received(other_app) == []
+
+
+def test_unsubscribed_topics_stop_arriving():
+    async def main():
+        hub = ConnectionHub()
+        connection = connect(hub, topics=["conversations", "contact:91"])
+        assert hub.unsubscribe(connection, ["contact:91"]) == ["conversations"]
+        hub.publish(1, {"n": 1}, "contact:91")
+        hub.publish(1, {"n": 2}, "conversations")
+        await settle()
+        return connection
+
+    assert received(run(main())) == [2]
+
+
+@pytest.mark.parametrize(
+    "policy, expected",
+    [("drop_oldest", [0, 3, 4]), ("drop_newest", [0, 1, 2])],
+)
+def test_full_queue_drops_by_policy(policy, expected):
+    async def main():
+        hub = ConnectionHub(max_queue=2, overflow_policy=policy)
+        websocket = FakeWebSocket()
+        websocket.block = asyncio.Event()
+        connection = connect(hub, websocket=websocket)
+        hub.publish(1, {"n": 0})
+        await settle()
+        # The writer holds frame 0; the queue holds two of the rest
+        for n in (1, 2, 3, 4):
+            hub.publish(1, {"n": n})
+        websocket.block.set()
+        await settle()
+        return hub, connection
+
+    hub, connection = run(main())
+    assert received(connection) == expected
+    assert connection.dropped == hub.dropped == 2
+
+
+def test_full_queue_evicts_slow_consumer():
+    async def main():
+        hub = ConnectionHub(max_queue=1, overflow_policy="disconnect")
+        websocket = FakeWebSocket()
+        websocket.block = asyncio.Event()
+        connection = connect(hub, websocket=websocket)
+        for n in range(3):
+            hub.publish(1, {"n": n})
+        await settle()
+        return hub, connection
+
+    hub, connection = run(main())
+    assert hub.evicted == 1
+    assert connection.closed
+    assert connection.websocket.close_code == 1013
+    assert hub.connections == {}
+
+
+def test_resume_replays_missed_events_of_the_topics():
+    async def main():
+        hub = ConnectionHub()
+        for n, topic in enumerate(["contact:91", "conversations", "contact:92"]):
+            hub.publish(1, {"n": n, "seq": 100 + n}, topic)
+        connection = connect(hub, topics=["contact:91", "contact:92"])
+        assert hub.resume(connection, 100)
+        await settle()
+        return hub, connection
+
+    hub, connection = run(main())
+    assert received(connection) == [2]
+    assert hub.replayed == 1
+
+
+@pytest.mark.parametrize("resume_from", [50, 500])
+def test_resume_outside_the_buffer_asks_for_a_resync(resume_from):
+    async def main():
+        hub = ConnectionHub(replay_size=3)
+        for n in range(5):
+            hub.publish(1, {"n": n, "seq": 100 + n})
+        connection = connect(hub)
+        # Too old (evicted from the buffer) or from another process
+        return hub.resume(connection, resume_from), connection
+
+    resumed, connection = run(main())
+    assert not resumed
+    assert connection.queue.empty()
+
+
+def test_resume_without_history_asks_for_a_resync():
+    async def main():
+        hub = ConnectionHub()
+        return hub.resume(connect(hub), 100)
+
+    assert not run(main())
+
+
+def test_unserializable_event_is_skipped_not_the_socket(capsys):
+    async def main():
+        hub = ConnectionHub()
+        connection = connect(hub)
+        hub.publish(1, {"n": 1, "at": object()})
+        hub.publish(1, {"n": 2})
+        await settle()
+        return hub, connection
+
+    hub, connection = run(main())
+    assert received(connection) == [2]
+    assert connection in hub.connections[1]
+    assert "not sent" in capsys.readouterr().out
+
+
+def test_writer_failure_is_logged_and_drops_the_socket(capsys):
+    async def main():
+        hub = ConnectionHub()
+        broken = connect(hub, websocket=FakeWebSocket(RuntimeError("boom")))
+        gone = connect(hub, websocket=FakeWebSocket(WebSocketDisconnect(1006)))
+        hub.publish(1, {"n": 1})
+        await settle()
+        return hub, broken, gone
+
+    hub, broken, gone = run(main())
+    assert hub.connections == {}
+    out = capsys.readouterr().out
+    # A client going away is routine; anything else is reported
+    assert "RuntimeError('boom')" in out
+    assert out.count("dropping") == 1
+
+
+def test_per_user_cap_applies_to_identified_users_only():
+    async def main():
+        hub = ConnectionHub(max_per_app=3, max_per_user=1)
+        connect(hub, user="user:1")
+        connect(hub)
+        assert hub.admit(1, "user:1") == "Too many connections for this user"
+        assert hub.admit(1, None) is None
+        connect(hub)
+        assert hub.admit(1, None) == "Too many connections for this app"
+        return hub
+
+    assert run(main()).rejected == 2
@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.orm import Session
+
+from models import Contact, Tag
+from app.services.app_registry import app_registry
+
+NOW = datetime(2026, 10, 18, 12, 0, 0)
+
+
+@pytest.fixture
+def contacts(db_engine):
+    # 10 contacts of app 1 and one of app 2, which belongs to another user
+    with Session(db_engine) as db:
+        vip = Tag(id=1, app_id=1, name="vip")
+        for i in range(1, 11):
+            db.add(
+                Contact(
+                    id=i,
+                    app_id=1,
+                    country_code="91",
+                    mobile_number=f"98765{i:05}",
+                    wa_id=f"9198765{i:05}",
+                    name=f"{'Ann' if i % 2 else 'Bob'} {i}",
+                    source="import" if i <= 3 else "webhook",
+                    opted_in=i != 4,
+                    is_active=i != 5,
+                    last_active_at=NOW - timedelta(days=i),
+                    tags=[vip] if i % 3 == 0 else [],
+                )
+            )
+        db.add(
+            Contact(
+                id=11,
+                app_id=2,
+                country_code="91",
+                mobile_number="9876599999",
+                wa_id="919876599999",
+                name="Ann elsewhere",
+            )
+        )
+        db.commit()
+
+
+def ids(response):
+    assert response.status_code == 200, response.text
+    return [contact["id"] for contact in response.json()]
+
+
+def test_contacts_of_another_users_app_are_not_listed(client, contacts):
+    # App 2 exists, so this is the ownership check, not "unknown app"
+    assert app_registry.get_by_id(2).user_id != 1
+    response = client.get("/contacts", params={"app_id": 2})
+    assert response.status_code == 404
+
+
+def test_contacts_of_an_unknown_app_are_not_listed(client, contacts):
+    response = client.get("/contacts", params={"app_id": 3})
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize(
+    "filters, expected",
+    [
+        ({}, [10, 9, 8, 7, 6, 5, 4, 3, 2, 1]),
+        ({"tag_id": 1}, [9, 6, 3]),
+        ({"opted_in": False}, [4]),
+        ({"is_active": False}, [5]),
+        ({"source": "import"}, [3, 2, 1]),
+        ({"name_prefix": "Bob"}, [10, 8, 6, 4, 2]),
+        ({"number_prefix": "+91987650001"}, [10]),
+        (
+            {
+                "last_active_from": (NOW - timedelta(days=4)).isoformat(),
+                "last_active_to": (NOW - timedelta(days=2)).isoformat(),
+            },
+            [4, 3],
+        ),
+        ({"source": "import", "name_prefix": "Ann"}, [3, 1]),
+    ],
+)
+def test_contacts_filters(client, contacts, filters, expected):
+    response = client.get("/contacts", params={"app_id": 1, **filters})
+    assert ids(response) == expected
+
+
+def test_contacts_name_prefix_is_literal(client, contacts):
+    # LIKE wildcards in the prefix match themselves, not any character
+    response = client.get("/contacts", params={"app_id": 1, "name_prefix": "A_n"})
+    assert ids(response) == []
+
+
+def test_contacts_keyset_pages(client, contacts):
+    params = {"app_id": 1, "limit": 4}
+    pages = []
+    response = client.get("/contacts", params=params)
+    pages.append(ids(response))
+    while "X-Next-Cursor" in response.headers:
+        cursor = response.headers["X-Next-Cursor"]
+        response = client.get("/contacts", params={**params, "cursor": cursor})
+        pages.append(ids(response))
+    assert pages == [[10, 9, 8, 7], [6, 5, 4, 3], [2, 1]]
+
+
+def test_contacts_keyset_pages_keep_the_filters(client, contacts):
+    params = {"app_id": 1, "limit": 2, "name_prefix": "Ann"}
+    first = client.get("/contacts", params=params)
+    assert ids(first) == [9, 7]
+    cursor = first.headers["X-Next-Cursor"]
+    second = client.get("/contacts", params={**params, "cursor": cursor})
+    assert ids(second) == [5, 3]
+
+
+def test_contacts_invalid_cursor(client, contacts):
+    response = client.get("/contacts", params={"app_id": 1, "cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+def test_contacts_deprecated_skip_still_pages(client, contacts):
+    response = client.get("/contacts", params={"app_id": 1, "limit": 3, "skip": 3})
+    assert ids(response) == [7, 6, 5]
+    assert "X-Next-Cursor" in response.headers
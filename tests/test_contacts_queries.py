@@ -0,0 +1,55 @@
+import pytest
+from sqlalchemy.orm import Session
+
+from models import Contact, Tag
+from query_count import assert_query_count
+from app.services.count_cache import CountCache
+
+
+@pytest.fixture
+def contacts(db_engine):
+    # 30 contacts of app 1, each with 0 to 3 tags
+    with Session(db_engine) as db:
+        tags = [Tag(app_id=1, name=f"tag {i}") for i in range(3)]
+        for i in range(30):
+            db.add(
+                Contact(
+                    app_id=1,
+                    country_code="91",
+                    mobile_number=f"98765{i:05}",
+                    wa_id=f"9198765{i:05}",
+                    name=f"Contact {i}",
+                    tags=tags[: i % 4],
+                )
+            )
+        db.commit()
+
+
+@pytest.fixture
+def count_cache(monkeypatch):
+    cache = CountCache(ttl=60.0)
+    monkeypatch.setattr("app.api.contact.contact_count_cache", cache)
+    return cache
+
+
+@pytest.mark.parametrize("limit", [5, 20])
+def test_contacts_page_runs_constant_queries(client, contacts, limit):
+    # The page, then the tags of every contact on it in one IN query
+    with assert_query_count(2):
+        response = client.get("/contacts", params={"app_id": 1, "limit": limit})
+    assert response.status_code == 200
+    page = response.json()
+    assert len(page) == limit
+    assert sum(len(contact["tags"]) for contact in page) > 0
+
+
+def test_contacts_total_is_counted_once_per_ttl(client, contacts, count_cache):
+    # The COUNT(*) behind X-Total-Count is cached per app and filters, not per
+    # page: only the first request of a TTL pays for it, whatever its limit
+    params = {"app_id": 1, "include_total": True}
+    with assert_query_count(3):
+        first = client.get("/contacts", params={**params, "limit": 5})
+    with assert_query_count(2):
+        second = client.get("/contacts", params={**params, "limit": 20})
+    assert first.headers["X-Total-Count"] == second.headers["X-Total-Count"] == "30"
+
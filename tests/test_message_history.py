@@ -0,0 +1,135 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.orm import Session
+
+from models import Contact, Message
+from app.crud.message import get_messages_by_contact_ws, history_page
+from app.crud.pagination import decode_cursor, encode_cursor
+from app.services.app_registry import app_registry
+
+
+def rows(*ids):
+    return [SimpleNamespace(id=i) for i in ids]
+
+
+def cursor(value):
+    return decode_cursor(value) if value else None
+
+
+@pytest.mark.parametrize(
+    "fetched, before_id, after_id, page, prev, next",
+    [
+        # Newest page: read newest first, one extra row means older ones exist
+        ([10, 9, 8, 7], None, None, [8, 9, 10], {"before_id": 8}, None),
+        ([3, 2, 1], None, None, [1, 2, 3], None, None),
+        # Scrolling back: newer messages always exist past before_id
+        ([6, 5, 4, 3], 7, None, [4, 5, 6], {"before_id": 4}, {"after_id": 6}),
+        ([2, 1], 3, None, [1, 2], None, {"after_id": 2}),
+        # Catching up: read oldest first, older messages always exist
+        ([5, 6, 7, 8], None, 4, [5, 6, 7], {"before_id": 5}, {"after_id": 7}),
+        ([9, 10], None, 8, [9, 10], {"before_id": 9}, None),
+        # Nothing past the position: no cursors to follow
+        ([], 1, None, [], None, None),
+        ([], None, 10, [], None, None),
+    ],
+)
+def test_history_page(fetched, before_id, after_id, page, prev, next):
+    messages, prev_cursor, next_cursor = history_page(
+        rows(*fetched), 3, before_id, after_id
+    )
+    assert [m.id for m in messages] == page
+    assert cursor(prev_cursor) == prev
+    assert cursor(next_cursor) == next
+
+
+@pytest.fixture
+def history(db_engine):
+    # Messages 1..7 of one conversation of app 1
+    with Session(db_engine) as db:
+        db.add(
+            Contact(
+                id=1,
+                app_id=1,
+                country_code="91",
+                mobile_number="9876500001",
+                wa_id="919876500001",
+            )
+        )
+        for i in range(1, 8):
+            db.add(
+                Message(
+                    id=i,
+                    app_id=1,
+                    contact_id=1,
+                    message_id=f"wamid.{i}",
+                    from_number="919876500001",
+                    to_number="15550001",
+                    message_type="text",
+                    payload={"body": str(i)},
+                    direction="inbound",
+                    status="sent",
+                    sent_at=datetime(2026, 10, 18) + timedelta(minutes=i),
+                )
+            )
+        db.commit()
+
+
+def get_history(client, **params):
+    response = client.get(
+        "/messages/919876500001", params={"app_id": 1, "limit": 3, **params}
+    )
+    assert response.status_code == 200, response.text
+    return [m["id"] for m in response.json()], response.headers
+
+
+def test_history_cursor_headers(client, history):
+    # Newest first in the body; X-Prev-Cursor scrolls back, X-Next-Cursor forward
+    ids, headers = get_history(client)
+    assert ids == [7, 6, 5]
+    assert "X-Next-Cursor" not in headers
+
+    ids, headers = get_history(client, cursor=headers["X-Prev-Cursor"])
+    assert ids == [4, 3, 2]
+    older = headers["X-Prev-Cursor"]
+
+    ids, headers = get_history(client, cursor=older)
+    assert ids == [1]
+    assert "X-Prev-Cursor" not in headers
+
+    ids, headers = get_history(client, cursor=headers["X-Next-Cursor"])
+    assert ids == [4, 3, 2]
+
+
+def test_history_explicit_ids(client, history):
+    assert get_history(client, before_id=3)[0] == [2, 1]
+    assert get_history(client, after_id=5)[0] == [7, 6]
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"cursor": "not-a-cursor"},
+        {"cursor": encode_cursor({"before_id": "abc"})},
+        {"cursor": encode_cursor([1, 2])},
+    ],
+)
+def test_history_invalid_cursor(client, history, params):
+    response = client.get("/messages/919876500001", params={"app_id": 1, **params})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "paging",
+    [{"offset": "ten"}, {"before_id": "abc"}, {"cursor": "not-a-cursor"}],
+)
+def test_ws_history_bad_paging_is_an_error_reply(apps, monkeypatch, paging):
+    async def aget_by_id(app_id):
+        return apps.get(int(app_id))
+
+    monkeypatch.setattr(app_registry, "aget_by_id", aget_by_id)
+    # Rejected before the database is touched, so no session is needed
+    result = asyncio.run(get_messages_by_contact_ws(None, 1, "919876500001", **paging))
+    assert result == {"error": "Invalid cursor", "messages": []}
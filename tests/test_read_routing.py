@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import exc as sa_exc
+
+from auth import create_access_token
+from database import Replica, get_db, get_read_db
+from dependency import pin_key_middleware
+
+
+@pytest.fixture
+def pin_client():
+    # The real session dependencies; they don't connect until a query runs
+    app = FastAPI()
+    app.middleware("http")(pin_key_middleware)
+
+    @app.get("/write")
+    def write(db=Depends(get_db)):
+        return db.info["pin_key"]
+
+    @app.get("/read")
+    def read(db=Depends(get_read_db)):
+        return db.info["pin_key"]
+
+    return TestClient(app)
+
+
+def test_sessions_are_pinned_by_the_token_subject(pin_client):
+    # Two tokens of one user share the pin key; anonymous requests have none
+    first = create_access_token({"sub": "owner@example.com"})
+    second = create_access_token({"sub": "owner@example.com"})
+    for path, token in (("/write", first), ("/read", second)):
+        response = pin_client.get(path, headers={"Authorization": f"Bearer {token}"})
+        assert response.json() == "user:owner@example.com"
+    assert pin_client.get("/read").json() is None
+    bad = {"Authorization": "Bearer not-a-jwt"}
+    assert pin_client.get("/read", headers=bad).json() is None
+
+
+class StatusConnection:
+    # Answers the replication status statements a given server version knows
+    def __init__(self, known: set, row: dict):
+        self.known = known
+        self.row = row
+        self.statements = []
+
+    async def exec_driver_sql(self, statement):
+        self.statements.append(statement)
+        if statement not in self.known:
+            raise sa_exc.ProgrammingError(statement, {}, Exception(1064, "syntax"))
+        return self
+
+    def mappings(self):
+        return self
+
+    def first(self):
+        return self.row
+
+
+def test_lag_probe_falls_back_to_show_slave_status():
+    replica = Replica("localhost")
+    conn = StatusConnection({"SHOW SLAVE STATUS"}, {"Seconds_Behind_Master": 3})
+
+    for _ in range(2):
+        row, column = asyncio.run(replica._replica_status(conn))
+        assert row[column] == 3
+    # The old syntax is remembered after the first failure
+    assert conn.statements == [
+        "SHOW REPLICA STATUS",
+        "SHOW SLAVE STATUS",
+        "SHOW SLAVE STATUS",
+    ]
+
+
+def test_lag_probe_uses_show_replica_status_when_known():
+    replica = Replica("localhost")
+    conn = StatusConnection({"SHOW REPLICA STATUS"}, {"Seconds_Behind_Source": 0})
+    row, column = asyncio.run(replica._replica_status(conn))
+    assert (column, row[column]) == ("Seconds_Behind_Source", 0)
+    assert conn.statements == ["SHOW REPLICA STATUS"]
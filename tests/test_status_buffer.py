@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services.status_buffer import StatusBuffer
+
+SENT = datetime(2026, 10, 18, 12, 0, 0)
+DELIVERED = SENT + timedelta(seconds=2)
+READ = SENT + timedelta(seconds=30)
+
+
+@pytest.fixture
+def buffer():
+    return StatusBuffer(retry_window=60.0)
+
+
+@pytest.mark.parametrize(
+    "callbacks",
+    [
+        [("sent", SENT), ("delivered", DELIVERED), ("read", READ)],
+        [("read", READ), ("delivered", DELIVERED), ("sent", SENT)],
+        [("delivered", DELIVERED), ("read", READ), ("sent", SENT)],
+        [("read", READ), ("sent", SENT), ("delivered", DELIVERED)],
+    ],
+)
+def test_delivered_read_sent_in_any_order_end_read(buffer, callbacks):
+    for status, timestamp in callbacks:
+        buffer.add("wamid.1", status, timestamp)
+
+    [(message_id, entry)] = buffer._pending.items()
+    assert message_id == "wamid.1"
+    assert entry["status"] == "read"
+    assert entry["received_at"] == DELIVERED
+    assert entry["read_at"] == READ
+    assert buffer.received == 3
+    assert buffer.coalesced == 2
+
+
+def test_read_alone_implies_delivery(buffer):
+    buffer.add("wamid.1", "read", READ)
+    entry = buffer._pending["wamid.1"]
+    assert (entry["status"], entry["received_at"], entry["read_at"]) == (
+        "read",
+        READ,
+        READ,
+    )
+
+
+def test_failed_wins_and_keeps_the_timestamps(buffer):
+    buffer.add("wamid.1", "delivered", DELIVERED)
+    buffer.add("wamid.1", "failed", READ)
+    buffer.add("wamid.1", "sent", SENT)
+    entry = buffer._pending["wamid.1"]
+    assert (entry["status"], entry["received_at"], entry["read_at"]) == (
+        "failed",
+        DELIVERED,
+        None,
+    )
+
+
+def test_unknown_statuses_are_ignored(buffer):
+    buffer.add("wamid.1", "enqueued", SENT)
+    assert buffer._pending == {}
+    assert buffer.received == 0
+
+
+def test_unmatched_callbacks_are_retried_within_the_window(buffer):
+    buffer.add("wamid.1", "delivered", DELIVERED)
+    buffer.add("wamid.2", "read", READ)
+    pending, buffer._pending = buffer._pending, {}
+    # wamid.2 was first seen longer ago than the retry window
+    pending["wamid.2"]["first_seen"] -= buffer.retry_window + 1
+
+    buffer._retry_unmatched(pending)
+    assert list(buffer._pending) == ["wamid.1"]
+    assert (buffer.unmatched_retried, buffer.unmatched_dropped) == (1, 1)
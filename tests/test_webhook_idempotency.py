@@ -0,0 +1,264 @@
+"""
+Redelivered webhooks must not store or broadcast a message twice.
+
+`drop_duplicate_messages` and `insert_messages` run on SQLite through a thin
+async wrapper of a sync session. The full /webhook round trip uses MySQL's
+upserts, so it needs TEST_MYSQL_URL like the EXPLAIN tests.
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+import models
+from main import app
+from database import get_async_db
+from models import App, Contact, Message, User
+from app.api import webhook
+from app.services.app_registry import AppSnapshot, app_registry
+from app.services.dedupe import RecentIds
+
+NOW = datetime(2026, 10, 18, 12, 0, 0)
+
+
+class AsyncSessionAdapter:
+    # The AsyncSession calls the ingestion helpers make, on a sync Session
+    def __init__(self, db: Session):
+        self.db = db
+
+    async def execute(self, *args, **kwargs):
+        return self.db.execute(*args, **kwargs)
+
+    async def scalars(self, *args, **kwargs):
+        return self.db.scalars(*args, **kwargs)
+
+    @asynccontextmanager
+    async def begin_nested(self):
+        with self.db.begin_nested():
+            yield
+
+
+@pytest.fixture
+def recent_ids(monkeypatch):
+    ids = RecentIds(100)
+    monkeypatch.setattr(webhook, "recent_message_ids", ids)
+    return ids
+
+
+@pytest.fixture
+def adb(db_engine, monkeypatch):
+    # SQLite reports a unique violation by message, not MySQL's error 1062
+    monkeypatch.setattr(webhook, "is_duplicate_key", lambda e: "UNIQUE" in str(e.orig))
+    with Session(db_engine) as db:
+        db.add(User(id=1, email="owner@example.com", password="x"))
+        db.add(App(id=1, user_id=1, business_name="Test", whatsapp_number="15550001"))
+        db.add(
+            Contact(
+                id=1,
+                app_id=1,
+                country_code="91",
+                mobile_number="9876500001",
+                wa_id="919876500001",
+            )
+        )
+        db.commit()
+        yield AsyncSessionAdapter(db)
+
+
+def message_row(message_id):
+    return {
+        "app_id": 1,
+        "contact_id": 1,
+        "message_id": message_id,
+        "from_number": "919876500001",
+        "to_number": "15550001",
+        "message_type": "text",
+        "payload": {"body": "hi"},
+        "direction": "inbound",
+        "status": "sent",
+        "sent_at": NOW,
+        "created_at": NOW,
+    }
+
+
+def inbound(*message_ids):
+    return [
+        ("15550001", "919876500001", "Ann", {"id": message_id, "type": "text"})
+        for message_id in message_ids
+    ]
+
+
+def stored_ids(adb) -> list:
+    return sorted(adb.db.scalars(select(Message.message_id)), key=str)
+
+
+def test_retries_are_dropped_from_the_recent_ids_cache(adb, recent_ids):
+    recent_ids.add_many(["wamid.1"])
+    fresh = asyncio.run(
+        webhook.drop_duplicate_messages(adb, inbound("wamid.1", "wamid.2"))
+    )
+    assert [item[3]["id"] for item in fresh] == ["wamid.2"]
+
+
+def test_retries_are_dropped_by_the_indexed_lookup(adb, recent_ids):
+    asyncio.run(webhook.insert_messages(adb, [message_row("wamid.1")]))
+    fresh = asyncio.run(
+        webhook.drop_duplicate_messages(adb, inbound("wamid.1", "wamid.2", "wamid.2"))
+    )
+    # Stored ids are remembered; a repeat inside the delivery is dropped too
+    assert [item[3]["id"] for item in fresh] == ["wamid.2"]
+    assert "wamid.1" in recent_ids
+
+
+def test_insert_returns_the_stored_messages_with_ids(adb):
+    rows = [message_row("wamid.1"), message_row(None), message_row("wamid.2")]
+    messages = asyncio.run(webhook.insert_messages(adb, rows))
+    assert [m.message_id for m in messages] == ["wamid.1", None, "wamid.2"]
+    assert all(m.id for m in messages)
+    assert len({m.id for m in messages}) == 3
+
+
+def test_insert_race_losers_are_skipped(adb):
+    # A concurrent delivery stored wamid.2 after this one checked for it
+    asyncio.run(webhook.insert_messages(adb, [message_row("wamid.2")]))
+    rows = [message_row("wamid.1"), message_row("wamid.2"), message_row("wamid.3")]
+    messages = asyncio.run(webhook.insert_messages(adb, rows))
+    assert [m.message_id for m in messages] == ["wamid.1", "wamid.3"]
+    assert stored_ids(adb) == ["wamid.1", "wamid.2", "wamid.3"]
+
+
+def test_rows_without_message_id_are_always_stored(adb):
+    messages = asyncio.run(
+        webhook.insert_messages(adb, [message_row(None), message_row(None)])
+    )
+    assert len(messages) == 2
+    assert stored_ids(adb) == [None, None]
+
+
+# ---------------- full round trip on MySQL ---------------- #
+
+
+def delivery(*message_ids):
+    return {
+        "entry": [
+            {
+                "changes": [
+                    {
+                        "value": {
+                            "metadata": {"display_phone_number": "15550001"},
+                            "contacts": [
+                                {"wa_id": "919876500001", "profile": {"name": "Ann"}}
+                            ],
+                            "messages": [
+                                {
+                                    "id": message_id,
+                                    "from": "919876500001",
+                                    "timestamp": str(int(NOW.timestamp())),
+                                    "type": "text",
+                                    "text": {"body": "hi"},
+                                }
+                                for message_id in message_ids
+                            ],
+                        }
+                    }
+                ]
+            }
+        ]
+    }
+
+
+@pytest.fixture
+def mysql_client(monkeypatch, recent_ids):
+    url = os.environ.get("TEST_MYSQL_URL")
+    if not url:
+        pytest.skip("TEST_MYSQL_URL is not set")
+    engine = create_engine(url)
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(User), [{"id": 1, "email": "owner@example.com", "password": "x"}]
+        )
+        conn.execute(
+            insert(App),
+            [
+                {
+                    "id": 1,
+                    "user_id": 1,
+                    "business_name": "Test",
+                    "whatsapp_number": "15550001",
+                }
+            ],
+        )
+    # No pool: each TestClient request runs on its own event loop
+    async_engine = create_async_engine(
+        make_url(url).set(drivername="mysql+aiomysql"), poolclass=NullPool
+    )
+    sessions = async_sessionmaker(async_engine, expire_on_commit=False)
+
+    async def session():
+        async with sessions() as db:
+            yield db
+
+    snapshot = AppSnapshot(1, 1, "Test", "15550001", True, True)
+
+    async def aget_by_number(number):
+        return snapshot if number == snapshot.whatsapp_number else None
+
+    monkeypatch.setattr(app_registry, "aget_by_number", aget_by_number)
+    app.dependency_overrides[get_async_db] = session
+    yield TestClient(app), engine
+    app.dependency_overrides.clear()
+    models.Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+def message_counts(engine) -> dict:
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(Message.message_id, func.count()).group_by(Message.message_id)
+        )
+        return dict(rows.all())
+
+
+@pytest.mark.mysql
+def test_redelivered_webhook_is_a_no_op(mysql_client, recent_ids):
+    client, engine = mysql_client
+    first = client.post("/webhook", json=delivery("wamid.1", "wamid.2"))
+    assert first.json() == {"status": "success", "count": 2}
+
+    # Once from the in-process cache, once from the message_id lookup
+    again = client.post("/webhook", json=delivery("wamid.1", "wamid.2"))
+    assert again.json()["count"] == 0
+    recent_ids.pop("wamid.1")
+    recent_ids.pop("wamid.2")
+    again = client.post("/webhook", json=delivery("wamid.1", "wamid.2"))
+    assert again.json()["count"] == 0
+
+    assert message_counts(engine) == {"wamid.1": 1, "wamid.2": 1}
+
+
+@pytest.mark.mysql
+def test_concurrent_redelivery_falls_back_to_savepoints(
+    mysql_client, recent_ids, monkeypatch
+):
+    # Both deliveries passed the duplicate check: the unique index rejects the
+    # batch (error 1062) and only the row nobody stored yet is counted
+    client, engine = mysql_client
+    client.post("/webhook", json=delivery("wamid.1"))
+
+    async def passthrough(db, inbound):
+        return inbound
+
+    monkeypatch.setattr(webhook, "drop_duplicate_messages", passthrough)
+    response = client.post("/webhook", json=delivery("wamid.1", "wamid.2"))
+    assert response.json() == {"status": "success", "count": 1}
+    assert message_counts(engine) == {"wamid.1": 1, "wamid.2": 1}
@@ -0,0 +1,77 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from app.services.webhook_queue import WebhookQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WebhookQueue(str(tmp_path / "queue.db"), workers=1, poll_interval=0.01)
+    yield queue
+    queue.close()
+
+
+def run_until(queue: WebhookQueue, handler, done, timeout: float = 5.0):
+    # Runs the worker pool until done() holds, then stops it
+    async def main():
+        queue.start(handler)
+        try:
+            async with asyncio.timeout(timeout):
+                while not done():
+                    await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+
+    asyncio.run(main())
+
+
+def rows(queue: WebhookQueue, table: str) -> list:
+    with sqlite3.connect(queue.path) as conn:
+        return conn.execute(f"SELECT * FROM {table} ORDER BY id").fetchall()
+
+
+def test_failed_batch_is_retried_row_by_row(queue):
+    # Far from dead-lettering, however often the bad row is retried meanwhile
+    queue.max_attempts = 1000
+    queue.open()
+    for body in (b"first", b"bad", b"third"):
+        queue.put(body)
+    calls = []
+
+    async def handler(bodies):
+        calls.append(bodies)
+        if b"bad" in bodies:
+            raise ValueError("unparseable")
+
+    run_until(queue, handler, lambda: queue.processed == 2)
+
+    # The whole batch, then each row alone: the good rows are acked, the bad
+    # one goes back to the queue for another attempt
+    assert calls[:4] == [[b"first", b"bad", b"third"], [b"first"], [b"bad"], [b"third"]]
+    assert queue.processed == 2
+    remaining = rows(queue, "webhook_queue")
+    assert [row[1] for row in remaining] == [b"bad"]
+    assert rows(queue, "webhook_dead_letters") == []
+
+
+def test_row_is_dead_lettered_after_max_attempts(queue):
+    queue.max_attempts = 3
+    queue.open()
+    queue.put(b"bad")
+    calls = []
+
+    async def handler(bodies):
+        calls.append(bodies)
+        raise ValueError("unparseable")
+
+    run_until(queue, handler, lambda: queue.dead_lettered == 1)
+
+    assert calls == [[b"bad"]] * 3
+    assert queue.failed == 3
+    assert rows(queue, "webhook_queue") == []
+    [(_, body, _, _, error)] = rows(queue, "webhook_dead_letters")
+    assert (body, error) == (b"bad", "unparseable")
+    queue.open()
+    assert queue.stats()["dead_letters"] == 1
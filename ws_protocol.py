@@ -0,0 +1,74 @@
+from websockets import frames
+from websockets.extensions.permessage_deflate import (
+    PerMessageDeflate,
+    ServerPerMessageDeflateFactory,
+)
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+
+from config import config
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """
+    permessage-deflate that leaves messages under `min_size` bytes uncompressed.
+
+    Small frames (acks, typing events) gain nothing from deflate but still
+    cost CPU on both ends; RFC 7692 lets any message go out uncompressed.
+    """
+
+    def __init__(self, *args, min_size: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+
+    def encode(self, frame: frames.Frame) -> frames.Frame:
+        if (
+            frame.opcode in (frames.OP_TEXT, frames.OP_BINARY)
+            and frame.fin
+            and len(frame.data) < self.min_size
+        ):
+            return frame
+        return super().encode(frame)
+
+
+class ThresholdPerMessageDeflateFactory(ServerPerMessageDeflateFactory):
+    def __init__(self, min_size: int = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.min_size = min_size
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(
+            params, accepted_extensions
+        )
+        return response_params, ThresholdPerMessageDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            min_size=self.min_size,
+        )
+
+
+def deflate_factory() -> ThresholdPerMessageDeflateFactory:
+    return ThresholdPerMessageDeflateFactory(
+        min_size=config.get("ws_deflate_min_size", 512),
+        server_max_window_bits=config.get("ws_deflate_max_window_bits", 12),
+        compress_settings={
+            "level": config.get("ws_deflate_level", 6),
+            "memLevel": config.get("ws_deflate_mem_level", 5),
+        },
+    )
+
+
+class DeflateWebSocketProtocol(WebSocketProtocol):
+    """
+    uvicorn's websockets protocol with a tunable permessage-deflate.
+
+    uvicorn only exposes an on/off switch for the extension; this swaps its
+    default factory for one configured from config.py.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.config.ws_per_message_deflate:
+            self.available_extensions = [deflate_factory()]